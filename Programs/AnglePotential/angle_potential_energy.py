@@ -1,16 +1,12 @@
 import math
 
+import BatchedPotential.batched_potential_energy as batched_potential_energy
+
 def _angle_pot_variables(molecule, atom1, atom2, atom3):
 
-    x1 = molecule.x[atom1]
-    y1 = molecule.y[atom1]
-    z1 = molecule.z[atom1]
-    x2 = molecule.x[atom2]
-    y2 = molecule.y[atom2]
-    z2 = molecule.z[atom2]
-    x3 = molecule.x[atom3]
-    y3 = molecule.y[atom3]
-    z3 = molecule.z[atom3]
+    x1, y1, z1 = molecule.coords[atom1]
+    x2, y2, z2 = molecule.coords[atom2]
+    x3, y3, z3 = molecule.coords[atom3]
 
     v21x = x1 - x2
     v23x = x3 - x2
@@ -47,13 +43,5 @@ def angle_pot_variables(molecule, atom1, atom2, atom3):
     return angle - a0, Ka
 
 def angle_potential(molecule):
-    nangles = molecule.topology.num_angles
-    Va = 0
-    for i in range(0, nangles * 3, 3):
-        delta_angle, Ka = angle_pot_variables(
-            molecule,
-            atom1=molecule.topology.angle_list[i] - 1,
-            atom2=molecule.topology.angle_list[i + 1] - 1,
-            atom3=molecule.topology.angle_list[i + 2] - 1)
-        Va += Ka * delta_angle * delta_angle
-    return Va
\ No newline at end of file
+    # All angles are evaluated at once by the batched kernels
+    return batched_potential_energy.angle_potential(molecule)
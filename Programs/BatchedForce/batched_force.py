@@ -0,0 +1,104 @@
+import numpy as np
+
+import BatchedPotential.batched_potential_energy as batched_potential_energy
+import NonbondedPotential.nonbonded_potential_energy as nonbonded_potential_energy
+
+# Analytic forces (minus the gradient of the potential energy) of all the bond,
+# angle and dihedral terms, computed together with the energies in a single pass
+# over the geometry. Per-term gradients are scatter-added into one
+# (..., natoms, 3) force array.
+
+def dot(a, b):
+    # dot products of the vectors along the last axis
+    return np.einsum('...i,...i->...', a, b)
+
+def safe_divide(a, b):
+    # a / b, with 0 where b is 0
+    return np.divide(a, b, out=np.zeros(np.broadcast(a, b).shape), where=b != 0)
+
+def scatter_forces(forces, index, term_forces):
+    # forces[..., index[m, k], :] += term_forces[..., m, k, :]
+    index = index.ravel()
+    term_forces = term_forces.reshape(term_forces.shape[:-3] + (-1, 3))
+    if forces.ndim == 2:
+        natoms = forces.shape[0]
+        for i in range(3):
+            forces[:, i] += np.bincount(index, weights=term_forces[:, i], minlength=natoms)
+    else:
+        np.add.at(forces, (Ellipsis, index, slice(None)), term_forces)
+
+def bond_energy_forces(coords, bonds, Kb, b0, forces):
+    v12 = coords[..., bonds[:, 1], :] - coords[..., bonds[:, 0], :]
+    b = np.sqrt(dot(v12, v12))
+    d = b - b0
+    # dVb/db = 2 * Kb * d, along the unit vector of the bond
+    g2 = safe_divide(2 * Kb * d, b)[..., None] * v12
+    scatter_forces(forces, bonds, np.stack((g2, -g2), axis=-2))
+    return (Kb * d * d).sum(axis=-1)
+
+def angle_energy_forces(coords, angles, Ka, a0, forces):
+    v21 = coords[..., angles[:, 0], :] - coords[..., angles[:, 1], :]
+    v23 = coords[..., angles[:, 2], :] - coords[..., angles[:, 1], :]
+    norm1 = np.sqrt(dot(v21, v21))
+    norm2 = np.sqrt(dot(v23, v23))
+    u21 = v21 * safe_divide(1, norm1)[..., None]
+    u23 = v23 * safe_divide(1, norm2)[..., None]
+    cos = np.clip(dot(u21, u23), -1, 1)
+    cos = np.where((norm1 == 0) | (norm2 == 0), 1, cos)
+    angle = np.arccos(cos)
+    delta = angle - a0
+    # dVa/dtheta * dtheta/dcos; linear angles (sin = 0) get no force
+    dV = safe_divide(2 * Ka * delta, np.sin(angle))
+    f1 = (dV * safe_divide(1, norm1))[..., None] * (u23 - cos[..., None] * u21)
+    f3 = (dV * safe_divide(1, norm2))[..., None] * (u21 - cos[..., None] * u23)
+    scatter_forces(forces, angles, np.stack((f1, -f1 - f3, f3), axis=-2))
+    return (Ka * delta * delta).sum(axis=-1)
+
+def dihedral_energy_forces(coords, dihedrals, term_dihedral, Vn, phase, n, forces):
+    b1 = coords[..., dihedrals[:, 1], :] - coords[..., dihedrals[:, 0], :]
+    b2 = coords[..., dihedrals[:, 2], :] - coords[..., dihedrals[:, 1], :]
+    b3 = coords[..., dihedrals[:, 3], :] - coords[..., dihedrals[:, 2], :]
+    m = np.cross(b1, b2)
+    p = np.cross(b2, b3)
+    norm_b2 = np.sqrt(dot(b2, b2))
+    phi = np.arctan2(norm_b2 * dot(b1, p), dot(m, p))
+    angle = n * phi[..., term_dihedral] - phase
+    energy = (Vn * (1 + np.cos(angle))).sum(axis=-1)
+    # dVd/dphi of each dihedral, summed over its Fourier terms
+    dV = batched_potential_energy.sum_by_index(-Vn * n * np.sin(angle), term_dihedral, len(dihedrals))
+    # Gradient of phi with respect to the four atoms (Bekker, 1996)
+    g1 = -safe_divide(norm_b2, dot(m, m))[..., None] * m
+    g4 = safe_divide(norm_b2, dot(p, p))[..., None] * p
+    s1 = safe_divide(dot(b1, b2), norm_b2 * norm_b2)[..., None]
+    s3 = safe_divide(dot(b3, b2), norm_b2 * norm_b2)[..., None]
+    g2 = s3 * g4 - (s1 + 1) * g1
+    g3 = -g1 - g2 - g4
+    gradient = np.stack((g1, g2, g3, g4), axis=-2)
+    scatter_forces(forces, dihedrals, -dV[..., None, None] * gradient)
+    return energy
+
+def energy_and_forces(molecule, coords=None, forces=None):
+    # Total energy and the (natoms, 3) forces on every atom, for the
+    # coordinates of the molecule or for the given (..., natoms, 3) coordinates.
+    # The nonbonded terms are included once a neighbor list has been set up
+    # (NonbondedPotential.nonbonded_potential_energy.assign_nonbonded).
+    top = batched_potential_energy.get_parameters(molecule)
+    if coords is None:
+        coords = batched_potential_energy.get_coordinates(molecule)
+    if forces is None:
+        forces = np.zeros(coords.shape, dtype=molecule.accum_dtype)
+    energy = bond_energy_forces(coords, top.bond_index, top.bond_Kb, top.bond_b0, forces)
+    energy = energy + angle_energy_forces(coords, top.angle_index, top.angle_Ka, top.angle_a0, forces)
+    energy = energy + dihedral_energy_forces(coords, top.dihedral_index, top.dihedral_term,
+                                             top.dihedral_Vn, top.dihedral_phase, top.dihedral_n, forces)
+    if top.neighbor_list is not None:
+        vdw, elec = nonbonded_potential_energy.nonbonded_energy_forces(molecule, coords, forces)
+        energy = energy + vdw + elec
+    return energy, forces
+
+def add_forces(forces, fx, fy, fz):
+    # Accumulates (natoms, 3) forces into the separate fx, fy, fz arrays used
+    # by bond_force, angle_force and dihedral_force
+    fx[:] = fx + forces[:, 0]
+    fy[:] = fy + forces[:, 1]
+    fz[:] = fz + forces[:, 2]
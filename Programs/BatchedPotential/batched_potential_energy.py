@@ -0,0 +1,190 @@
+import numpy as np
+
+import profiling
+
+# Batched bond, angle and dihedral potential energies. Instead of visiting one
+# term at a time, every term of the molecule is evaluated with array math over
+# (N, 2), (N, 3) and (N, 4) arrays of 0-based atom indices. Coordinates are
+# (..., natoms, 3) arrays, so the same kernels work for a single geometry or
+# for a stack of conformers.
+
+def get_index_array(flat_list, width):
+    # Converts the flattened 1-based lists of the topology (bond_list,
+    # angle_list, dihedral_list) into (N, width) arrays of 0-based indices.
+    return np.asarray(flat_list, dtype=np.intp).reshape(-1, width) - 1
+
+def get_coordinates(molecule):
+    # (natoms, 3) coordinates in the accumulation type of the molecule
+    return molecule.coords.astype(molecule.accum_dtype)
+
+def _norm(v):
+    return np.sqrt(np.einsum('...i,...i->...', v, v))
+
+def sum_by_index(values, index, size):
+    # Sums values[..., k] into out[..., index[k]]
+    out = np.zeros(values.shape[:-1] + (size,), dtype=values.dtype)
+    np.add.at(out, (Ellipsis, index), values)
+    return out
+
+def bond_lengths(coords, bonds):
+    v12 = coords[..., bonds[:, 1], :] - coords[..., bonds[:, 0], :]
+    return _norm(v12)
+
+def angle_values(coords, angles):
+    v21 = coords[..., angles[:, 0], :] - coords[..., angles[:, 1], :]
+    v23 = coords[..., angles[:, 2], :] - coords[..., angles[:, 1], :]
+    norm = _norm(v21) * _norm(v23)
+    dot = np.einsum('...i,...i->...', v21, v23)
+    # degenerate angles (coincident atoms) are taken as 0, as in angle_pot_variables
+    cos = np.divide(dot, norm, out=np.ones_like(dot), where=norm != 0)
+    return np.arccos(np.clip(cos, -1, 1))
+
+def dihedral_values(coords, dihedrals):
+    # Same construction as get_dihedral_angle.get_dihedral_angle, vectorized
+    v21 = coords[..., dihedrals[:, 0], :] - coords[..., dihedrals[:, 1], :]
+    v23 = coords[..., dihedrals[:, 2], :] - coords[..., dihedrals[:, 1], :]
+    v34 = coords[..., dihedrals[:, 3], :] - coords[..., dihedrals[:, 2], :]
+    u23 = v23 / _norm(v23)[..., None]
+    proj1 = v21 - np.einsum('...i,...i->...', v21, u23)[..., None] * u23
+    proj2 = v34 - np.einsum('...i,...i->...', v34, u23)[..., None] * u23
+    dx = np.einsum('...i,...i->...', proj1, proj2)
+    dy = np.einsum('...i,...i->...', np.cross(u23, proj1), proj2)
+    return np.arctan2(dy, dx)
+
+def bond_energies(coords, bonds, Kb, b0):
+    d = bond_lengths(coords, bonds) - b0
+    return Kb * d * d
+
+def angle_energies(coords, angles, Ka, a0):
+    delta = angle_values(coords, angles) - a0
+    return Ka * delta * delta
+
+def dihedral_term_energies(phi, term_dihedral, Vn, phase, n):
+    # One entry per Fourier term: Vn * (1 + cos(n * phi - phase)), where
+    # term_dihedral maps each term to the dihedral it belongs to.
+    return Vn * (1 + np.cos(n * phi[..., term_dihedral] - phase))
+
+def dihedral_energies(coords, dihedrals, term_dihedral, Vn, phase, n):
+    phi = dihedral_values(coords, dihedrals)
+    terms = dihedral_term_energies(phi, term_dihedral, Vn, phase, n)
+    return sum_by_index(terms, term_dihedral, len(dihedrals))
+
+def type_keys(molecule, index):
+    # Unique atom type combinations present in index, and the position of
+    # each term in that list of unique combinations.
+    # Each combination is encoded as one integer (the type codes as digits
+    # in base ntypes), which is much faster to sort than rows of codes.
+    types, codes = np.unique(np.asarray(molecule.atom_type), return_inverse=True)
+    powers = max(len(types), 1) ** np.arange(index.shape[1] - 1, -1, -1, dtype=np.int64)
+    keys, inverse = np.unique(codes.reshape(-1)[index] @ powers, return_inverse=True)
+    combos = keys[:, None] // powers % max(len(types), 1)
+    return types[combos], inverse.reshape(-1)
+
+def _lookup(types_dict, key_types, kind):
+    key = '-'.join(key_types)
+    if key not in types_dict:
+        key = '-'.join(key_types[::-1])
+        if key not in types_dict:
+            raise AttributeError('Could not find corresponding {} type'.format(kind))
+    return types_dict[key]
+
+def bond_parameters(molecule, bonds):
+    if len(bonds) == 0:
+        return np.zeros(0), np.zeros(0)
+    keys, inverse = type_keys(molecule, bonds)
+    params = np.array([_lookup(molecule.topology.bond_types, k, 'bond') for k in keys],
+                      dtype=np.float64).reshape(-1, 2)
+    return params[inverse, 0], params[inverse, 1]
+
+def angle_parameters(molecule, angles):
+    if len(angles) == 0:
+        return np.zeros(0), np.zeros(0)
+    keys, inverse = type_keys(molecule, angles)
+    params = np.array([_lookup(molecule.topology.angle_types, k, 'angle') for k in keys],
+                      dtype=np.float64).reshape(-1, 2)
+    return params[inverse, 0], params[inverse, 1]
+
+def dihedral_mask(molecule, dihedrals):
+    # Dihedrals with an 'hc' atom at either end are left out of the
+    # potential, as in total_dihedral_potential.
+    atom_type = np.asarray(molecule.atom_type)
+    return (atom_type[dihedrals[:, 0]] != 'hc') & (atom_type[dihedrals[:, 3]] != 'hc')
+
+def dihedral_parameters(molecule, dihedrals):
+    # Returns the Fourier terms of every dihedral flattened into per-term
+    # arrays: (term_dihedral, Vn, phase, n), with term_dihedral sorted.
+    if len(dihedrals) == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0), np.zeros(0), np.zeros(0)
+    keys, inverse = type_keys(molecule, dihedrals)
+    profiling.count('dihedral_parameters.lookups', len(keys))
+    terms = [_lookup(molecule.topology.dihedral_types, k, 'dihedral') for k in keys]
+    counts = np.array([len(t) for t in terms], dtype=np.intp)
+    table = np.array([term for t in terms for term in t], dtype=np.float64).reshape(-1, 4)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    # gather the term rows of each dihedral
+    per_dihedral = counts[inverse]
+    term_dihedral = np.repeat(np.arange(len(dihedrals)), per_dihedral)
+    rows = np.repeat(starts[inverse], per_dihedral) + ranges(per_dihedral)
+    return term_dihedral, table[rows, 1], table[rows, 2], table[rows, 3]
+
+def ranges(counts):
+    # concatenation of arange(c) for every c in counts
+    ends = np.cumsum(counts)
+    return np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - counts, counts)
+
+def get_parameters(molecule):
+    # Parameter tables of the topology, resolved by Molecule.assign_parameters
+    # only when the topology lists have changed since the last assignment
+    if not molecule.topology.parameters_assigned:
+        molecule.assign_parameters()
+    return molecule.topology
+
+def select_dihedrals(topology, rows):
+    # Dihedrals rows of the assigned tables, with their Fourier terms
+    # renumbered to the selection: (dihedrals, term_dihedral, Vn, phase, n).
+    start = topology.dihedral_ptr[rows]
+    counts = topology.dihedral_ptr[rows + 1] - start
+    terms = np.repeat(start, counts) + ranges(counts)
+    return (topology.dihedral_index[rows], np.repeat(np.arange(len(rows)), counts),
+            topology.dihedral_Vn[terms], topology.dihedral_phase[terms], topology.dihedral_n[terms])
+
+def dihedral_rows(dihedrals):
+    # {(a, b, c, d): k} of the rows of a (M, 4) dihedral table, in both
+    # orientations
+    rows = {}
+    for k, d in enumerate(np.asarray(dihedrals).tolist()):
+        rows[tuple(d)] = k
+        rows[tuple(d[::-1])] = k
+    return rows
+
+def get_dihedral_subset(molecule, dihedral_list):
+    topology = get_parameters(molecule)
+    dihedrals = get_index_array(dihedral_list, 4)
+    dihedrals = dihedrals[dihedral_mask(molecule, dihedrals)]
+    rows = [topology.dihedral_rows.get(d) for d in map(tuple, dihedrals.tolist())]
+    if None in rows:
+        # dihedrals that are not part of the topology are resolved on the spot
+        return (dihedrals,) + dihedral_parameters(molecule, dihedrals)
+    return select_dihedrals(topology, np.array(rows, dtype=np.intp))
+
+def bond_potential(molecule):
+    top = get_parameters(molecule)
+    return float(bond_energies(get_coordinates(molecule), top.bond_index,
+                               top.bond_Kb, top.bond_b0).sum())
+
+def angle_potential(molecule):
+    top = get_parameters(molecule)
+    return float(angle_energies(get_coordinates(molecule), top.angle_index,
+                                top.angle_Ka, top.angle_a0).sum())
+
+def dihedral_potential(molecule, dihedral_list=None):
+    if dihedral_list is None:
+        top = get_parameters(molecule)
+        dihedrals, term_dihedral = top.dihedral_index, top.dihedral_term
+        Vn, phase, n = top.dihedral_Vn, top.dihedral_phase, top.dihedral_n
+    else:
+        dihedrals, term_dihedral, Vn, phase, n = get_dihedral_subset(molecule, dihedral_list)
+    if len(dihedrals) == 0:
+        return 0.0
+    return float(dihedral_energies(get_coordinates(molecule), dihedrals,
+                                   term_dihedral, Vn, phase, n).sum())
@@ -1,7 +1,7 @@
+import BatchedPotential.batched_potential_energy as batched_potential_energy
+
 def bond_pot_variables(molecule, atom1, atom2):
-    bx = molecule.x[atom2] - molecule.x[atom1]
-    by = molecule.y[atom2] - molecule.y[atom1]
-    bz = molecule.z[atom2] - molecule.z[atom1]
+    bx, by, bz = molecule.coords[atom2] - molecule.coords[atom1]
     b = (bx * bx + by * by + bz * bz) ** 0.5  # distance between atoms 1 and 2
     btype = ('{}-{}'.format(molecule.atom_type[atom1],
                             molecule.atom_type[atom2])
@@ -24,12 +24,5 @@ def bond_pot_variables(molecule, atom1, atom2):
     return bx, by, bz, b, b0, Kb, d
 
 def bond_potential(molecule):
-    nbonds = molecule.topology.num_bonds
-    Vb = 0
-    for i in range(0, nbonds * 2, 2):
-        bx, by, bz, b, b0, Kb, d = bond_pot_variables(
-            molecule,
-            atom1=molecule.topology.bond_list[i] - 1,
-            atom2=molecule.topology.bond_list[i + 1] - 1)
-        Vb += Kb * d * d
-    return Vb
+    # All bonds are evaluated at once by the batched kernels
+    return batched_potential_energy.bond_potential(molecule)
@@ -0,0 +1,94 @@
+import numpy as np
+
+from BatchedPotential.batched_potential_energy import ranges
+
+class BondGraph:
+    # Adjacency index of the bonds in compressed sparse row (CSR) form: the
+    # neighbors of atom i (0-based) are neighbors[offsets[i]:offsets[i+1]], in
+    # ascending order. Neighbor queries cost O(degree) instead of the O(N) row
+    # scan of the triangular bond matrix.
+
+    def __init__(self, num_atoms, bonds):
+        # bonds: (num_bonds, 2) array of 0-based atom indices
+        bonds = np.asarray(bonds, dtype=np.intp).reshape(-1, 2)
+        i = np.concatenate((bonds[:, 0], bonds[:, 1]))
+        j = np.concatenate((bonds[:, 1], bonds[:, 0]))
+        order = np.lexsort((j, i))
+        self.num_atoms = num_atoms
+        self.neighbors = j[order]
+        self.offsets   = np.zeros(num_atoms + 1, dtype=np.intp)
+        np.cumsum(np.bincount(i, minlength=num_atoms), out=self.offsets[1:])
+        self._lists    = None
+
+    @staticmethod
+    def from_arrays(num_atoms, neighbors, offsets):
+        # Graph over CSR arrays built before (e.g. read from a snapshot)
+        graph = BondGraph.__new__(BondGraph)
+        graph.num_atoms = num_atoms
+        graph.neighbors = neighbors
+        graph.offsets   = offsets
+        graph._lists    = None
+        return graph
+
+    def get_neighbors(self, i):
+        return self.neighbors[self.offsets[i]:self.offsets[i+1]]
+
+    def get_degrees(self):
+        return np.diff(self.offsets)
+
+    def get_angles(self):
+        # (num_angles, 3) array of all the angles i-j-k, enumerated as the 
+        # pairs of neighbors (i < k) of every center atom j
+        degrees = self.get_degrees()
+        center = np.repeat(np.arange(self.num_atoms), degrees)
+        # entry p of the CSR arrays pairs with the later entries of its row
+        later = self.offsets[center + 1] - np.arange(len(self.neighbors)) - 1
+        first = np.repeat(np.arange(len(self.neighbors)), later)
+        second = first + 1 + ranges(later)
+        return np.stack((self.neighbors[first], center[first], self.neighbors[second]), axis=1)
+
+    def get_dihedrals(self, bonds):
+        # (num_dihedrals, 4) array of the proper dihedrals a-b-c-d around every 
+        # bond b-c of bonds, with a and d neighbors of b and c other than c, b 
+        # and each other (three-membered rings)
+        bonds = np.asarray(bonds, dtype=np.intp).reshape(-1, 2)
+        b, c = bonds[:, 0], bonds[:, 1]
+        degrees = self.get_degrees()
+        counts = degrees[b] * degrees[c]
+        pair = np.repeat(np.arange(len(bonds)), counts)
+        r = ranges(counts)
+        a = self.neighbors[self.offsets[b[pair]] + r // degrees[c[pair]]]
+        d = self.neighbors[self.offsets[c[pair]] + r % degrees[c[pair]]]
+        dihedrals = np.stack((a, b[pair], c[pair], d), axis=1)
+        return dihedrals[(a != c[pair]) & (d != b[pair]) & (a != d)]
+
+    def get_neighbor_lists(self):
+        # Neighbors as Python lists, for the graph traversals below
+        if self._lists is None:
+            flat = self.neighbors.tolist()
+            offsets = self.offsets.tolist()
+            self._lists = [flat[offsets[i]:offsets[i+1]] for i in range(self.num_atoms)]
+        return self._lists
+
+    def get_moving_side(self, b, c):
+        # Atoms on the side of c of the bond b-c (c included, b excluded),
+        # found by an iterative breadth-first search that does not cross the
+        # bond. These are the atoms that move in a torsion around b-c. If
+        # b-c belongs to a ring, the search goes around it and the result
+        # contains neighbors of b as well.
+        adjacency = self.get_neighbor_lists()
+        visited = bytearray(self.num_atoms)
+        visited[b] = visited[c] = 1
+        side = [c]
+        k = 0
+        while k < len(side):
+            for n in adjacency[side[k]]:
+                if not visited[n]:
+                    visited[n] = 1
+                    side.append(n)
+            k += 1
+        return np.array(side, dtype=np.intp)
+
+    def is_ring_bond(self, b, c):
+        neighbors = self.get_neighbors(b)
+        return bool(np.isin(neighbors[neighbors != c], self.get_moving_side(b, c)).any())
@@ -0,0 +1,186 @@
+import numpy as np
+
+import BatchedForce.batched_force as batched_force
+import IO.trajectory as trajectory
+
+# K conformers of one molecule, held as a (K, natoms, 3) stack that shares the
+# topology and parameters of the molecule. Energies and forces of the whole
+# stack come from one call of the batched kernels, and ranking, clustering
+# and minimization work on all the conformers at once.
+
+class ConformerEnsemble:
+    def __init__(self, molecule, coords=None):
+        self.molecule = molecule
+        if coords is None:
+            coords = molecule.coords[None]
+        self.coords = np.array(coords, dtype=molecule.float_dtype).reshape(-1, molecule.num_atoms, 3)
+        self.energies = None # (K,) energies of the last evaluation
+
+    def __len__(self):
+        return len(self.coords)
+
+    def add(self, coords):
+        # Appends one (natoms, 3) conformer or a (K, natoms, 3) stack
+        coords = np.asarray(coords, dtype=self.coords.dtype).reshape(-1, self.molecule.num_atoms, 3)
+        self.coords = np.concatenate((self.coords, coords))
+        self.energies = None
+
+    def energy_and_forces(self):
+        # (K,) energies and (K, natoms, 3) forces of every conformer
+        coords = self.coords.astype(self.molecule.accum_dtype)
+        energies, forces = batched_force.energy_and_forces(self.molecule, coords)
+        self.energies = np.asarray(energies)
+        return self.energies, forces
+
+    def get_energies(self):
+        if self.energies is None:
+            self.energy_and_forces()
+        return self.energies
+
+    def sort(self):
+        # Reorders the conformers from the lowest energy up
+        order = np.argsort(self.get_energies(), kind='stable')
+        self.coords = self.coords[order]
+        self.energies = self.energies[order]
+        return order
+
+    def select(self, index):
+        # New ensemble with the given conformers
+        ensemble = ConformerEnsemble(self.molecule, self.coords[index])
+        if self.energies is not None:
+            ensemble.energies = self.energies[index]
+        return ensemble
+
+    def rmsd_matrix(self, atoms=None):
+        # (K, K) RMSD between every pair of conformers after optimal
+        # superposition (Kabsch), over the given atoms or all of them
+        coords = self.coords.astype(np.float64)
+        if atoms is not None:
+            coords = coords[:, atoms]
+        coords = coords - coords.mean(axis=1, keepdims=True)
+        # covariance of every pair, and its singular values with the sign
+        # correction for reflections
+        H = np.einsum('ani,bnj->abij', coords, coords)
+        U, S, Vt = np.linalg.svd(H)
+        S[..., 2] *= np.sign(np.linalg.det(U) * np.linalg.det(Vt))
+        sq = (coords * coords).sum(axis=(1, 2))
+        msd = (sq[:, None] + sq[None, :] - 2 * S.sum(axis=-1)) / coords.shape[1]
+        return np.sqrt(np.maximum(msd, 0))
+
+    def cluster(self, threshold=0.5, atoms=None):
+        # Leader clustering in order of energy: every conformer joins the
+        # first (lowest-energy) leader within threshold Angstroms RMSD, or
+        # becomes a new leader. Returns the cluster of each conformer and the
+        # leaders.
+        rmsd = self.rmsd_matrix(atoms)
+        labels = np.full(len(self), -1, dtype=np.intp)
+        leaders = []
+        for k in np.argsort(self.get_energies(), kind='stable'):
+            close = [c for c, leader in enumerate(leaders) if rmsd[k, leader] < threshold]
+            if close:
+                labels[k] = close[0]
+            else:
+                labels[k] = len(leaders)
+                leaders.append(k)
+        return labels, np.array(leaders, dtype=np.intp)
+
+    def _line_search(self, coords, energies, forces, direction, c1=1e-4, min_step=1e-10):
+        # Backtracking (Armijo) line search of every conformer along its
+        # direction, starting from a unit step. Only the conformers still
+        # searching are evaluated again. Returns the accepted steps (0 where
+        # none was found) and the new coordinates, energies and forces.
+        steps = np.ones(len(coords))
+        accepted = np.zeros(len(coords))
+        new_coords, new_energies, new_forces = coords.copy(), energies.copy(), forces.copy()
+        slope = -(forces * direction).sum(axis=(1, 2))
+        pending = np.flatnonzero(slope < 0)
+        while len(pending):
+            trial = coords[pending] + steps[pending, None, None] * direction[pending]
+            trial_energies, trial_forces = batched_force.energy_and_forces(self.molecule, trial)
+            ok = trial_energies <= energies[pending] + c1 * steps[pending] * slope[pending]
+            done = pending[ok]
+            accepted[done] = steps[done]
+            new_coords[done], new_energies[done], new_forces[done] = trial[ok], trial_energies[ok], trial_forces[ok]
+            steps[pending] *= 0.5
+            pending = pending[~ok & (steps[pending] > min_step)]
+        return accepted, new_coords, new_energies, new_forces
+
+    def minimize(self, max_iterations=1000, rms_tolerance=1e-3, energy_tolerance=1e-8,
+                 memory=10, max_step=0.2):
+        # L-BFGS of every conformer at once, as Minimization.minimize.lbfgs:
+        # each conformer has its own history, line search and convergence
+        # test, and stops moving once converged. Returns the number of
+        # iterations and the (K,) convergence flags.
+        K = len(self)
+        coords = self.coords.astype(self.molecule.accum_dtype)
+        energies, forces = batched_force.energy_and_forces(self.molecule, coords)
+        converged = np.sqrt((forces * forces).mean(axis=(1, 2))) < rms_tolerance
+        s_list, y_list, rho_list = [], [], [] # (K, 3N) pairs, rho = 0 where unused
+        iterations = 0
+        while not converged.all() and iterations < max_iterations:
+            active = ~converged
+            # two-loop recursion, for all the conformers together
+            q = forces.reshape(K, -1).copy()
+            alphas = []
+            for s, y, rho in zip(reversed(s_list), reversed(y_list), reversed(rho_list)):
+                alpha = rho * (s * q).sum(axis=1)
+                q -= alpha[:, None] * y
+                alphas.append(alpha)
+            gamma = np.ones(K)
+            for s, y, rho in zip(s_list, y_list, rho_list):
+                # scaling from the latest pair of each conformer
+                gamma = np.where(rho > 0, batched_force.safe_divide((s * y).sum(axis=1), (y * y).sum(axis=1)), gamma)
+            q *= gamma[:, None]
+            for s, y, rho, alpha in zip(s_list, y_list, rho_list, reversed(alphas)):
+                beta = rho * (y * q).sum(axis=1)
+                q += (alpha - beta)[:, None] * s
+            direction = q.reshape(forces.shape)
+            # not a descent direction: restart that conformer from its force
+            reset = (direction * forces).sum(axis=(1, 2)) <= 0
+            direction[reset] = forces[reset]
+            for rho in rho_list:
+                rho[reset] = 0
+            largest = np.sqrt((direction * direction).sum(axis=-1)).max(axis=-1)
+            direction *= np.where(largest > max_step, max_step / np.maximum(largest, 1e-300), 1)[:, None, None]
+            direction[converged] = 0
+            accepted, new_coords, new_energies, new_forces = self._line_search(
+                coords, energies, forces, direction)
+            moved = active & (accepted > 0)
+            # no downhill step: converged if the history was already empty
+            empty = np.ones(K, dtype=bool)
+            for rho in rho_list:
+                empty &= rho == 0
+            failed = active & ~moved
+            converged |= failed & empty
+            for rho in rho_list:
+                rho[failed] = 0
+            s = (new_coords - coords).reshape(K, -1)
+            y = (forces - new_forces).reshape(K, -1)
+            sy = (s * y).sum(axis=1)
+            s_list.append(s)
+            y_list.append(y)
+            rho_list.append(np.where(moved & (sy > 1e-12), batched_force.safe_divide(1, sy), 0))
+            if len(s_list) > memory:
+                del s_list[0], y_list[0], rho_list[0]
+            change = np.abs(energies - new_energies)
+            coords, energies, forces = new_coords, new_energies, new_forces
+            rms = np.sqrt((forces * forces).mean(axis=(1, 2)))
+            converged |= moved & ((rms < rms_tolerance) | (change < energy_tolerance))
+            iterations += 1
+        self.coords = coords.astype(self.coords.dtype)
+        self.energies = energies
+        return iterations, converged
+
+    def set_molecule(self, k):
+        # Copies conformer k to the coordinates of the molecule
+        self.molecule.restore(self.coords[k])
+
+    def write_mol2(self, filename):
+        with trajectory.Mol2TrajectoryWriter(self.molecule, filename, 'w+') as writer:
+            for frame in self.coords:
+                writer.write_frame(frame)
+
+    def write_npy(self, filename):
+        with trajectory.NpyTrajectoryWriter(filename, self.molecule.num_atoms,
+                                            self.coords.dtype) as writer:
+            writer.write_frame(self.coords)
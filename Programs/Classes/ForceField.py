@@ -0,0 +1,126 @@
+import hashlib
+import math
+import os
+import pickle
+
+# Force-field parameters read from a frcmod file, loaded once and shared.
+# load_forcefield keeps every ForceField in a module-level cache keyed by
+# (path, mtime, size), so that molecules of the same process (and pool
+# workers forked after it was loaded) share one read-only copy of the
+# dictionaries. Parsed files are also pickled to CACHE_DIR under the SHA-256
+# of their contents, so that other processes and later runs skip the parsing.
+
+CACHE_VERSION = 2
+CACHE_DIR = os.environ.get('FORCEFIELD_CACHE',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'projetoIC', 'forcefield'))
+
+_forcefields = {}  # (path, mtime_ns, size) -> ForceField
+
+class ForceField:
+    def __init__(self):
+        self.filename       = ''
+        self.digest         = '' # SHA-256 of the file contents
+        self.bond_types     = {} # e.g. bond_types['c3-hc'] = (Kb, b0)
+        self.angle_types    = {} # e.g. angle_types['hc-c3-hc'] = (Ka, a0 in radians)
+        self.dihedral_types = {}
+        # e.g. dihedral_types['c3-c3-c3-c3'] = [[idivf, Vn, phase in radians, n], ...],
+        # one entry per Fourier term
+        self.nonbonded_types = {} # e.g. nonbonded_types['c3'] = (R*, epsilon), R* = Rmin/2
+
+    def parse_frcmod(self, text):
+        lines = iter(text.split('\n'))
+        for line in lines:
+            if line.startswith('BOND'):
+                for line in lines:
+                    if not line.strip():
+                        break
+                    self.bond_types[line[0:5].strip()] = (
+                        (float(line[5:13].strip()), float(line[13:21].strip()))
+                        )
+            elif line.startswith('ANGLE'):
+                for line in lines:
+                    if not line.strip():
+                        break
+                    angle_rad = float(line[17:29].strip())*math.pi/180
+                    self.angle_types[line[0:8].strip()] = (
+                        (float(line[8:17].strip()), angle_rad)
+                        )
+            elif line.startswith('DIHE'):
+                for line in lines:
+                    if not line.strip():
+                        break
+                    key = line[0:11]
+                    angle_rad = float(line[24:38].strip())*math.pi/180
+                    term = [int(line[11:15].strip()), float(line[15:24].strip()),
+                            angle_rad, float(line[38:54].strip())]
+                    if key not in self.dihedral_types.keys():
+                        self.dihedral_types[key] = [term]
+                    else:
+                        self.dihedral_types[key].append(term)
+            elif line.startswith('NONBON'):
+                for line in lines:
+                    if not line.strip():
+                        break
+                    fields = line.split()
+                    self.nonbonded_types[fields[0]] = (float(fields[1]), float(fields[2]))
+
+    def read_frcmod(self, filename):
+        with open(filename, 'rb') as inf:
+            data = inf.read()
+        self.filename = filename
+        self.digest = hashlib.sha256(data).hexdigest()
+        self.parse_frcmod(data.decode())
+
+def _cache_file(digest):
+    return os.path.join(CACHE_DIR, '{}.v{}.pkl'.format(digest, CACHE_VERSION))
+
+def _read_cache(digest):
+    try:
+        with open(_cache_file(digest), 'rb') as inf:
+            forcefield = pickle.load(inf)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+    if not isinstance(forcefield, ForceField) or forcefield.digest != digest:
+        return None
+    return forcefield
+
+def _write_cache(forcefield):
+    # Written to a temporary file and renamed, so that concurrent workers
+    # never read a partial pickle; a read-only cache directory is ignored
+    filename = _cache_file(forcefield.digest)
+    temporary = '{}.{}.tmp'.format(filename, os.getpid())
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(temporary, 'wb') as outf:
+            pickle.dump(forcefield, outf, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, filename)
+    except OSError:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+def load_forcefield(filename, use_disk_cache=True):
+    # The ForceField of a frcmod file, shared by every caller. It must be
+    # treated as read-only.
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    forcefield = _forcefields.get(key)
+    if forcefield is not None:
+        return forcefield
+    with open(path, 'rb') as inf:
+        data = inf.read()
+    digest = hashlib.sha256(data).hexdigest()
+    forcefield = _read_cache(digest) if use_disk_cache else None
+    if forcefield is None:
+        forcefield = ForceField()
+        forcefield.digest = digest
+        forcefield.parse_frcmod(data.decode())
+        if use_disk_cache:
+            _write_cache(forcefield)
+    forcefield.filename = path
+    _forcefields[key] = forcefield
+    return forcefield
+
+def clear_cache():
+    # Empties the in-process cache (the files in CACHE_DIR are kept)
+    _forcefields.clear()
@@ -1,9 +1,56 @@
 import numpy as np
 import math
+import re
 from Classes.Trimatrix import Trimatrix
+from Classes.BondGraph import BondGraph
+import Classes.ForceField as ForceField
+import BatchedPotential.batched_potential_energy as batched_potential_energy
+import IO.snapshot as molecule_snapshot
+
+def index_dtype(natoms):
+    # Smallest unsigned integer type able to hold atom numbers up to natoms
+    return np.min_scalar_type(max(natoms, 1))
+
+def _split_records(body, nrecords, ncolumns):
+    # Splits the first nrecords lines of a section into a (nrecords, ncolumns) 
+    # array of strings, padding missing trailing columns with ''. When every 
+    # record has the same number of tokens (the first one being the serial 
+    # number) the whole block is split at once, otherwise line by line.
+    if nrecords == 0:
+        return np.empty((0, ncolumns), dtype='U1')
+    tokens = body.split()
+    columns = None
+    if len(tokens) % nrecords == 0:
+        columns = np.array(tokens).reshape(nrecords, -1)
+        if not np.char.isdigit(columns[:, 0]).all():
+            columns = None
+    if columns is None:
+        records = [line.split() for line in body.split('\n') if line.strip()][:nrecords]
+        width = max(len(r) for r in records)
+        columns = np.array([r + [''] * (width - len(r)) for r in records])
+    if columns.shape[1] < ncolumns:
+        padding = np.full((nrecords, ncolumns - columns.shape[1]), '', dtype='U1')
+        columns = np.concatenate((columns, padding), axis=1)
+    return columns
+
+# Precision policies: (storage, accumulation) floating-point types. 'mixed' 
+# keeps coordinates, charges and masses in float32 and computes energies and 
+# forces in float64; 'double' uses float64 throughout, for validation.
+PRECISIONS = {'mixed': ('float32', 'float64'), 'double': ('float64', 'float64')}
+
+_PSF_HEADER = re.compile(rb'^[ \t]*(\d+)[ \t]+!(\w+)[^\n]*\n?', re.M)
+_PDB_ATOM   = re.compile(rb'^(?:ATOM|HETATM)[^\n]*', re.M)
+_PDB_END    = re.compile(rb'^(?:TER|END)', re.M)
+
+def _read_indices(body, count, width):
+    # (count, width) integers from the first count*width tokens of a section
+    values = np.fromstring(body, dtype=np.int64, sep=' ')[:count*width]
+    if len(values) != count*width:
+        raise ValueError('Expected {} indices, found {}'.format(count*width, len(values)))
+    return values.reshape(count, width)
 
 class Molecule:
-    def __init__(self):
+    def __init__(self, precision='mixed'):
         self.topology  = self.Topology()
         self.id        = [] # 'ATOM' or 'HETATM'
         self.atom      = [] # atom name
@@ -13,9 +60,8 @@ class Molecule:
         self.chain     = [] # chain identifier
         self.res_num   = [] # residue sequence number
         self.ins_code  = [] # insertion code for residues
-        self.x         = [] # orthogonal coordinates for X (in Angstroms)
-        self.y         = [] # orthogonal coordinates for Y (in Angstroms)
-        self.z         = [] # orthogonal coordinates for Z (in Angstroms)
+        self.coords    = None # (num_atoms, 3) orthogonal coordinates (in Angstroms);
+                              # x, y and z are views of its columns
         self.occup     = [] # occupancy
         self.temp      = [] # temperature factor
         self.element   = [] # element symbol
@@ -23,6 +69,54 @@ class Molecule:
         self.num_atoms = 0  # number of atoms
         self.molecule_type = ''
         self.charge_type = ''
+        self.forcefield = None # Classes.ForceField.ForceField the parameters come from
+        self.precision   = ''   # key of PRECISIONS
+        self.float_dtype = None # storage type of coordinates, charges and masses
+        self.accum_dtype = None # type in which energies and forces are computed
+        self.set_precision(precision)
+        self.coords = np.zeros((0, 3), dtype=self.float_dtype)
+
+    def _set_axis(self, axis, values):
+        values = np.asarray(values, dtype=self.float_dtype)
+        if self.coords.shape[0] != len(values):
+            self.coords = np.zeros((len(values), 3), dtype=self.float_dtype)
+        self.coords[:, axis] = values
+
+    # x, y and z read and write the columns of coords in place
+    x = property(lambda self: self.coords[:, 0], lambda self, values: self._set_axis(0, values))
+    y = property(lambda self: self.coords[:, 1], lambda self, values: self._set_axis(1, values))
+    z = property(lambda self: self.coords[:, 2], lambda self, values: self._set_axis(2, values))
+
+    def snapshot(self):
+        # Copy of the coordinates, for restore()
+        return self.coords.copy()
+
+    def restore(self, coords):
+        # Puts back coordinates from snapshot() (or any (num_atoms, 3) array)
+        self.coords[:] = coords
+
+    def save_snapshot(self, filename, source=None):
+        # Binary snapshot of the prepared molecule (see IO.snapshot); source
+        # is an optional list of the files it was prepared from
+        molecule_snapshot.write_snapshot(self, filename, source)
+
+    def load_snapshot(self, filename, mmap_mode='c'):
+        # Replaces this molecule by a snapshot; its arrays are views of the 
+        # memory-mapped file
+        molecule_snapshot.read_snapshot(self, filename, mmap_mode)
+
+    def set_precision(self, precision):
+        # Switches the precision policy, converting the arrays already read
+        if precision not in PRECISIONS:
+            raise ValueError('Unknown precision: {}'.format(precision))
+        self.precision   = precision
+        self.float_dtype = np.dtype(PRECISIONS[precision][0])
+        self.accum_dtype = np.dtype(PRECISIONS[precision][1])
+        for owner, name in ((self, 'coords'), (self, 'occup'), (self, 'temp'),
+                            (self.topology, 'charge'), (self.topology, 'mass')):
+            value = getattr(owner, name)
+            if isinstance(value, np.ndarray):
+                setattr(owner, name, value.astype(self.float_dtype))
 
     class Topology:
         def __init__(self):
@@ -45,7 +139,11 @@ class Molecule:
             # representation, for the sake of memory savings. The presence or 
             # absence of a bond between atoms (row, column) is indicated in 
             # self.bond_matrix[k], where k corresponds to indices (i, j) in 
-            # matricial representation.
+            # matricial representation. Its size grows with num_atoms**2, so it 
+            # is only built on request (Molecule.get_bond_matrix()).
+            self.bond_graph    = None
+            # Adjacency lists of the bonds (Classes.BondGraph), built when the 
+            # bonds are read.
 
             self.num_angles     = 0  # number of angles
             self.angle_list     = [] # list of angles - in triplets
@@ -67,61 +165,81 @@ class Molecule:
             # self.dihedral_types['c3-c3-c3-c3'][2] (dihedral angle converted to radians) 
             # or self.dihedral_types['c3-c3-c3-c3'][3] (multiplicity).
 
+            self.nonbonded_types = {}
+            # e.g. self.nonbonded_types['c3'][0] (R*, half the Lennard-Jones minimum 
+            # distance, in Angstroms) or self.nonbonded_types['c3'][1] (well depth).
+
+            self.parameters_assigned = False
+            # Per-term parameter tables, filled by Molecule.assign_parameters() 
+            # from the dictionaries above, so that the energy and force routines 
+            # do not look up type strings. Atom indices are 0-based.
+            self.bond_index     = None # (num_bonds, 2) bonded atoms
+            self.bond_Kb        = None # elastic constant of each bond
+            self.bond_b0        = None # equilibrium length of each bond
+            self.angle_index    = None # (num_angles, 3) atoms of each angle
+            self.angle_Ka       = None # elastic constant of each angle
+            self.angle_a0       = None # equilibrium value of each angle (radians)
+            self.dihedral_index = None # (M, 4) dihedrals that enter the potential
+            self.dihedral_ptr   = None
+            # The Fourier terms of dihedral k are the entries 
+            # dihedral_ptr[k]:dihedral_ptr[k+1] of the arrays below.
+            self.dihedral_term  = None # dihedral each term belongs to
+            self.dihedral_Vn    = None # barrier height of each term
+            self.dihedral_phase = None # phase of each term (radians)
+            self.dihedral_n     = None # periodicity of each term
+            self.dihedral_rows  = None # {(a, b, c, d): k}, in both orientations
+
+            # Nonbonded tables, filled by NonbondedPotential.nonbonded_potential_energy.
+            # assign_nonbonded(); the nonbonded terms enter the energy and forces 
+            # only when neighbor_list is set.
+            self.nonbonded_Rmin    = None # R* of each atom
+            self.nonbonded_epsilon = None # Lennard-Jones well depth of each atom
+            self.nonbonded_charge  = None # partial charge of each atom (accumulation type)
+            self.excluded_pairs    = None # sorted i*num_atoms+j keys (i < j) of 1-2 and 1-3 pairs
+            self.pairs14           = None # (P, 2) 1-4 pairs, computed with scaled terms
+            self.neighbor_list     = None # NonbondedPotential.neighbor_list.NeighborList
+
     def read_mol2(self, filename):
-        with open (filename, 'r') as inf:
-            line = inf.readline()
-            while line:
-                if line.startswith('@<TRIPOS>MOLECULE'):
-                    line = inf.readline()
-                    line = inf.readline().split()
-                    self.num_atoms          = int(line[0])
-                    self.topology.num_bonds = int(line[1])
-                    self.topology.num_subst = int(line[2])
-                    self.topology.num_feat  = int(line[3])
-                    self.topology.num_sets  = int(line[4])
-                    self.molecule_type = inf.readline().strip()
-                    self.charge_type   = inf.readline().strip()
-                elif line.startswith('@<TRIPOS>ATOM'):
-                    natoms = self.num_atoms
-                    self.atom = np.empty(natoms, dtype='U4')
-                    self.x = np.zeros(natoms, dtype='float32')
-                    self.y = np.zeros(natoms, dtype='float32')
-                    self.z = np.zeros(natoms, dtype='float32')
-                    self.atom_type       = np.empty(natoms, dtype='U5')
-                    self.topology.charge     = np.zeros(natoms, dtype='float16')
-                    self.topology.subst_id   = np.zeros(natoms, dtype='uint8')
-                    self.topology.subst_name = np.empty(natoms, dtype='U5')
-                    for i in range(natoms):
-                        line = inf.readline().split()
-                        self.atom[i] = line[1]
-                        self.x[i] = float(line[2])
-                        self.y[i] = float(line[3])
-                        self.z[i] = float(line[4])
-                        self.atom_type[i]       = line[5]
-                        self.topology.subst_id[i]   = line[6]
-                        self.topology.subst_name[i] = line[7]
-                        if len(line) > 8:
-                            self.topology.charge[i]     = line[8]
-                elif line.startswith('@<TRIPOS>BOND'):
-                    nbonds = self.topology.num_bonds
-                    self.topology.bond_list   = np.zeros(nbonds * 2, dtype='uint8')
-                    self.topology.bond_matrix = np.zeros(Trimatrix.get_size(
-                        self.num_atoms
-                    ), dtype=bool)
-                    for i in range(0, nbonds*2, 2):
-                        line = inf.readline().split()
-                        self.topology.bond_matrix[Trimatrix.get_index(
-                            int(line[1]) - 1, int(line[2]) - 1
-                        )] = True
-                        self.topology.bond_list[i]   = line[1]
-                        self.topology.bond_list[i+1] = line[2]
-                elif line.startswith('@<TRIPOS>SUBSTRUCTURE'):
-                    line = inf.readline().strip()
-                    while line:
-                        self.topology.substructures.append(line)
-                        line = inf.readline().strip()
-
-                line = inf.readline()
+        with open(filename, 'r') as inf:
+            self.parse_mol2(inf.read())
+
+    def parse_mol2(self, text):
+        # Each @<TRIPOS> section is parsed as a whole: the ATOM and BOND 
+        # records are split into one block of tokens and converted to numpy 
+        # arrays column by column, instead of line by line.
+        for section in text.split('@<TRIPOS>')[1:]:
+            name, _, body = section.partition('\n')
+            name = name.strip()
+            if name == 'MOLECULE':
+                lines = body.split('\n')
+                counts = [int(n) for n in lines[1].split()] + [0, 0, 0, 0, 0]
+                self.num_atoms          = counts[0]
+                self.topology.num_bonds = counts[1]
+                self.topology.num_subst = counts[2]
+                self.topology.num_feat  = counts[3]
+                self.topology.num_sets  = counts[4]
+                self.molecule_type = lines[2].strip() if len(lines) > 2 else ''
+                self.charge_type   = lines[3].strip() if len(lines) > 3 else ''
+            elif name == 'ATOM':
+                natoms = self.num_atoms
+                columns = _split_records(body, natoms, 9)
+                self.atom = columns[:, 1].copy()
+                self.coords = columns[:, 2:5].astype(self.float_dtype)
+                self.atom_type           = columns[:, 5].copy()
+                self.topology.subst_id   = columns[:, 6].astype(index_dtype(natoms))
+                self.topology.subst_name = columns[:, 7].copy()
+                charge = np.where(columns[:, 8] == '', '0', columns[:, 8])
+                self.topology.charge     = charge.astype(self.float_dtype)
+            elif name == 'BOND':
+                columns = _split_records(body, self.topology.num_bonds, 4)
+                self.set_bonds(columns[:, 1:3].astype(np.int64))
+            elif name == 'SUBSTRUCTURE':
+                for line in body.split('\n'):
+                    line = line.strip()
+                    if not line:
+                        break
+                    self.topology.substructures.append(line)
+        self.topology.parameters_assigned = False
         self.gen_angle_list_from_bond_list()
 
     def write_mol2(self, filename, mode):
@@ -129,8 +247,9 @@ class Molecule:
             natoms = self.num_atoms
             nbonds = self.topology.num_bonds
             outf.write('@<TRIPOS>MOLECULE\nMOL\n')
-            outf.write('{:>5d}{:>5d}'.format(natoms, nbonds))
-            outf.write('{:>5}{:>5}{:>5}\n'.format(self.topology.num_subst, self.topology.num_feat, self.topology.num_sets))
+            # the counts are separated by spaces, so that they can be read at any size
+            outf.write('{:>5d} {:>5d}'.format(natoms, nbonds))
+            outf.write(' {:>5} {:>5} {:>5}\n'.format(self.topology.num_subst, self.topology.num_feat, self.topology.num_sets))
             outf.write('{}\n{}\n\n\n'.format(self.molecule_type, self.charge_type))
             outf.write('@<TRIPOS>ATOM\n')
             for i in range(natoms):
@@ -152,71 +271,38 @@ class Molecule:
             outf.write('\n')
 
     def read_psf(self, filename):
-        with open(filename, 'r') as inf:
-            line = inf.readline()
-            while line:
-                if '!NATOM' in line:
-                    natoms = self.num_atoms = int(line.split()[0])
-                    self.topology.segid     = np.empty(natoms, dtype='U3')
-                    self.topology.resid     = np.zeros(natoms, dtype='uint8')
-                    self.topology.resname   = np.empty(natoms, dtype='U3')
-                    self.topology.name      = np.empty(natoms, dtype='U5')
-                    self.atom_type      = np.empty(natoms, dtype='U5')
-                    self.topology.charge    = np.zeros(natoms, dtype='float16')
-                    self.topology.mass      = np.zeros(natoms, dtype='float16')
-
-                    for i in range(self.num_atoms):
-                        line = inf.readline().split()
-                        self.topology.segid[i]   = line[1]
-                        self.topology.resid[i]   = line[2]
-                        self.topology.resname[i] = line[3]
-                        self.topology.name[i]    = line[4]
-                        self.atom_type[i]    = line[5]
-                        self.topology.charge[i]  = line[6]
-                        self.topology.mass[i]    = line[7]
-
-                elif '!NBOND' in line:
-                    nbonds = int(line.split()[0])
-                    self.topology.num_bonds = nbonds
-                    num_lines = math.ceil(nbonds/4)
-                    self.topology.bond_list   = np.zeros(nbonds*2, dtype='uint8')
-                    self.topology.bond_matrix = np.zeros(Trimatrix.get_size(
-                        self.num_atoms
-                        ), dtype=bool)
-                    count = 0
-
-                    for i in range(num_lines):
-                        line = inf.readline().split()
-                        for j in range(0, len(line), 2):
-                            self.topology.bond_matrix[Trimatrix.get_index(
-                                int(line[j])-1, int(line[j+1])-1
-                                )] = True
-                            self.topology.bond_list[count] = line[j]
-                            self.topology.bond_list[count+1] = line[j+1]
-                            count += 2
-
-                elif '!NTHETA' in line:
-                    nangles = self.topology.num_angles = int(line.split()[0])
-                    num_lines = math.ceil(nangles/3)
-                    self.topology.angle_list = np.zeros(nangles*3, dtype='uint8')
-                    count = 0
-                    for i in range(num_lines):
-                        line = inf.readline().split()
-                        for j in range(len(line)):
-                            self.topology.angle_list[count] = line[j]
-                            count+=1
-
-                elif '!NPHI' in line:
-                    ndihed = self.topology.num_dihedrals = int(line.split()[0])
-                    num_lines = math.ceil(ndihed/2)
-                    self.topology.dihedral_list = np.zeros(ndihed*4, dtype='uint8')
-                    count = 0
-                    for i in range(num_lines):
-                        line = inf.readline().split()
-                        for j in range(len(line)):
-                            self.topology.dihedral_list[count] = line[j]
-                            count+=1
-                line = inf.readline()
+        with open(filename, 'rb') as inf:
+            data = inf.read()
+        # Every section starts with a "<count> !<NAME>" line; its body runs up 
+        # to the next such line. The atom records are split as one block of 
+        # tokens and the index sections are converted to integers at once.
+        headers = list(_PSF_HEADER.finditer(data))
+        for k, header in enumerate(headers):
+            count = int(header.group(1))
+            name = header.group(2)
+            end = headers[k+1].start() if k + 1 < len(headers) else len(data)
+            body = data[header.end():end]
+            if name == b'NATOM':
+                natoms = self.num_atoms = count
+                columns = _split_records(body.decode(), natoms, 8)
+                self.topology.segid   = columns[:, 1].copy()
+                self.topology.resid   = columns[:, 2].astype(np.int32)
+                self.topology.resname = columns[:, 3].copy()
+                self.topology.name    = columns[:, 4].copy()
+                self.atom_type        = columns[:, 5].copy()
+                self.topology.charge  = columns[:, 6].astype(self.float_dtype)
+                self.topology.mass    = columns[:, 7].astype(self.float_dtype)
+            elif name == b'NBOND':
+                self.set_bonds(_read_indices(body, count, 2))
+            elif name == b'NTHETA':
+                self.topology.num_angles = count
+                self.topology.angle_list = _read_indices(body, count, 3).astype(
+                    index_dtype(self.num_atoms)).ravel()
+            elif name == b'NPHI':
+                self.topology.num_dihedrals = count
+                self.topology.dihedral_list = _read_indices(body, count, 4).astype(
+                    index_dtype(self.num_atoms)).ravel()
+        self.topology.parameters_assigned = False
 
     def write_psf(self, filename):
         with open(filename, 'w+') as outf:
@@ -273,72 +359,53 @@ class Molecule:
                     outf.write('\n')
 
     def read_pdb(self, filename):
-        with open(filename, 'r') as inf:
-            if self.num_atoms != 0:
-                # Statically allocates memory if a corresponding .psf file has already 
-                # been read, which will determine the amount of memory (proportional to the 
-                # number of atoms) that needs to be preallocated. Static allocation is 
-                # preferable to dynamic allocation, since it uses numpy arrays, which can 
-                # save up memory by limiting the variables sizes. Also, the 'append' method 
-                # is slower than preallocating the elements and then assigning them values.
-                natoms        = self.num_atoms
-                self.id       = np.empty(natoms, dtype='U6')
-                self.atom     = np.empty(natoms, dtype='U4')
-                self.alt_loc  = np.empty(natoms, dtype='U1')
-                self.residue  = np.empty(natoms, dtype='U3')
-                self.chain    = np.empty(natoms, dtype='U1')
-                self.res_num  = np.zeros(natoms, dtype='uint8')
-                self.ins_code = np.empty(natoms, dtype='U1')
-                self.x        = np.zeros(natoms, dtype='float32')
-                self.y        = np.zeros(natoms, dtype='float32')
-                self.z        = np.zeros(natoms, dtype='float32')
-                self.occup    = np.zeros(natoms, dtype='float16')
-                self.temp     = np.zeros(natoms, dtype='float16')
-                self.element  = np.empty(natoms, dtype='U3')
-                self.charge   = np.empty(natoms, dtype='U2')
-                i = 0
-
-                for line in inf:
-                    if line.startswith('ATOM') or line.startswith('HETATM'):
-                        self.id[i]       = line[0:6].strip()
-                        self.atom[i]     = line[12:16].strip()
-                        self.alt_loc[i]  = line[16:17].strip()
-                        self.residue[i]  = line[17:20].strip()
-                        self.chain[i]    = line[21:22].strip()
-                        self.res_num[i]  = line[22:26]
-                        self.ins_code[i] = line[26:27].strip()
-                        self.x[i]        = line[30:38]
-                        self.y[i]        = line[38:46]
-                        self.z[i]        = line[46:54]
-                        self.occup[i]    = line[54:60]
-                        self.temp[i]     = line[60:66].strip()
-                        self.element[i]  = line[72:75].strip()
-                        self.charge[i]   = line[75:77].strip()
-                        i+=1
-
-                    elif line.startswith('TER') or line.startswith('END'):
-                        break
-
-            else:
-                for line in inf:
-                    if line.startswith('ATOM') or line.startswith('HETATM'):
-                        self.id.append(         line[0:6].strip())
-                        self.atom.append(       line[12:16].strip())
-                        self.alt_loc.append(    line[16:17].strip())
-                        self.residue.append(    line[17:20].strip())
-                        self.chain.append(      line[21:22].strip())
-                        self.res_num.append(int(line[22:26]))
-                        self.ins_code.append(   line[26:27].strip())
-                        self.x.append(float(    line[30:38]))
-                        self.y.append(float(    line[38:46]))
-                        self.z.append(float(    line[46:54]))
-                        self.occup.append(float(line[54:60]))
-                        self.temp.append(float( line[60:66].strip()))
-                        self.element.append(    line[72:75].strip())
-                        self.charge.append(     line[75:77].strip())
-                    elif line.startswith('TER') or line.startswith('END'):
-                        break
-                self.num_atoms = len(self.id)
+        # The ATOM/HETATM records (up to the first TER or END) are padded to 
+        # 80 columns and viewed as one (natoms, 80) array of bytes, from which 
+        # every fixed-width field is sliced and converted as a whole column.
+        with open(filename, 'rb') as inf:
+            data = inf.read()
+        stop = _PDB_END.search(data)
+        if stop is not None:
+            data = data[:stop.start()]
+        lines = _PDB_ATOM.findall(data)
+        natoms = len(lines)
+        if self.num_atoms != 0 and self.num_atoms != natoms:
+            raise ValueError('{} has {} atoms, expected {}'.format(filename, natoms, self.num_atoms))
+        self.num_atoms = natoms
+        records = np.frombuffer(b''.join(line.rstrip(b'\r').ljust(80)[:80] for line in lines),
+                                dtype='S1').reshape(natoms, 80)
+
+        def field(start, end):
+            column = np.ascontiguousarray(records[:, start:end]).view('S{}'.format(end - start))
+            return np.char.strip(column.ravel())
+
+        def number(start, end, dtype):
+            # one separated text block parsed in C; blank fields are read as 0
+            block = np.empty((natoms, end - start + 1), dtype='S1')
+            block[:, :-1] = records[:, start:end]
+            block[:, -1] = b' '
+            try:
+                values = np.fromstring(block.tobytes(), dtype=np.float64, sep=' ')
+            except ValueError:
+                values = ()
+            if len(values) != natoms:
+                column = field(start, end)
+                values = np.where(column == b'', b'0', column)
+            return values.astype(dtype)
+
+        self.id       = field(0, 6).astype('U6')
+        self.atom     = field(12, 16).astype('U4')
+        self.alt_loc  = field(16, 17).astype('U1')
+        self.residue  = field(17, 20).astype('U3')
+        self.chain    = field(21, 22).astype('U1')
+        self.res_num  = number(22, 26, np.int32)
+        self.ins_code = field(26, 27).astype('U1')
+        self.coords   = np.stack((number(30, 38, np.float64), number(38, 46, np.float64),
+                                  number(46, 54, np.float64)), axis=1).astype(self.float_dtype)
+        self.occup    = number(54, 60, self.float_dtype)
+        self.temp     = number(60, 66, self.float_dtype)
+        self.element  = field(72, 75).astype('U3')
+        self.charge   = field(75, 77).astype('U2')
 
     def write_pdb(self, filename, mode, n):
         with open(filename, mode) as outf:
@@ -347,7 +414,7 @@ class Molecule:
                 if self.id[i] == 'ATOM' or self.id[i] == 'HETATM':
                     outf.write('{:6s}{:5d} {:^4s}{:1s}{:3s} {:1s}{:4d}{:1s}   {:8.3f}{:8.3f}{:8.3f}{:6.2f}{:6.2f}      {:>2s}{:2s}\n'.format(
                     self.id[i],
-                    i+1,    # atom serial number
+                    i % 99999 + 1,    # atom serial number (wraps after 99999, as in VMD)
                     self.atom[i],
                     self.alt_loc[i],
                     self.residue[i],
@@ -364,52 +431,78 @@ class Molecule:
             outf.write('END\n')
 
     def read_frcmod(self, filename):
-        with open(filename, 'r') as inf:
-            line = inf.readline()
-            while line:
-                if line.startswith('BOND'):
-                    line = inf.readline()
-                    while line.strip():
-                        self.topology.bond_types[line[0:5].strip()] = (
-                            (float(line[5:13].strip()), float(line[13:21].strip()))
-                            )
-                        line = inf.readline()
-                elif line.startswith('ANGLE'):
-                    line = inf.readline()
-                    while line.strip():
-                        angle_rad = float(line[17:29].strip())*math.pi/180
-                        self.topology.angle_types[line[0:8].strip()] = (
-                            (float(line[8:17].strip()), angle_rad)
-                            )
-                        line = inf.readline()
-                elif line.startswith('DIHE'):
-                    line = inf.readline()
-                    while line.strip():
-                        key = line[0:11]
-                        angle_rad = float(line[24:38].strip())*math.pi/180
-                        line = [int(line[11:15].strip()), float(line[15:24].strip()),
-                                 angle_rad, float(line[38:54].strip())]
-                        if key not in self.topology.dihedral_types.keys():
-                            self.topology.dihedral_types[key] = [line]
-                        else:
-                            self.topology.dihedral_types[key].append(line)
-                        line = inf.readline()
-                line = inf.readline()
+        # The parameters come from the shared, cached Classes.ForceField of 
+        # the file: the dictionaries of the topology are the force field's own 
+        # (read-only) unless this molecule already has parameters from another 
+        # file, in which case both are merged into new dictionaries.
+        self.set_forcefield(ForceField.load_forcefield(filename))
+
+    def set_forcefield(self, forcefield):
+        top = self.topology
+        if not (top.bond_types or top.angle_types or top.dihedral_types or top.nonbonded_types):
+            top.bond_types      = forcefield.bond_types
+            top.angle_types     = forcefield.angle_types
+            top.dihedral_types  = forcefield.dihedral_types
+            top.nonbonded_types = forcefield.nonbonded_types
+        else:
+            top.bond_types      = dict(top.bond_types, **forcefield.bond_types)
+            top.angle_types     = dict(top.angle_types, **forcefield.angle_types)
+            top.nonbonded_types = dict(top.nonbonded_types, **forcefield.nonbonded_types)
+            dihedral_types  = {key: list(terms) for key, terms in top.dihedral_types.items()}
+            for key, terms in forcefield.dihedral_types.items():
+                dihedral_types.setdefault(key, []).extend(terms)
+            top.dihedral_types = dihedral_types
+        self.forcefield = forcefield
+        top.parameters_assigned = False
+        if self.num_atoms != 0:
+            self.assign_parameters()
+
+    def assign_parameters(self):
+        # Resolves every bond, angle and dihedral to its force field parameters 
+        # once per topology. The energy routines call it again by themselves 
+        # whenever the lists have changed since (parameters_assigned is False).
+        top = self.topology
+        top.bond_index = batched_potential_energy.get_index_array(top.bond_list, 2)
+        top.bond_Kb, top.bond_b0 = batched_potential_energy.bond_parameters(self, top.bond_index)
+        top.angle_index = batched_potential_energy.get_index_array(top.angle_list, 3)
+        top.angle_Ka, top.angle_a0 = batched_potential_energy.angle_parameters(self, top.angle_index)
+        dihedrals = batched_potential_energy.get_index_array(top.dihedral_list, 4)
+        dihedrals = dihedrals[batched_potential_energy.dihedral_mask(self, dihedrals)]
+        (top.dihedral_term, top.dihedral_Vn, top.dihedral_phase, top.dihedral_n
+        ) = batched_potential_energy.dihedral_parameters(self, dihedrals)
+        top.dihedral_index = dihedrals
+        top.dihedral_ptr = np.concatenate(([0], np.cumsum(
+            np.bincount(top.dihedral_term, minlength=len(dihedrals))))).astype(np.intp)
+        top.dihedral_rows = batched_potential_energy.dihedral_rows(dihedrals)
+        top.parameters_assigned = True
+
+    def set_bonds(self, bonds):
+        # bonds: (num_bonds, 2) 1-based atom numbers
+        bonds = np.asarray(bonds).reshape(-1, 2)
+        self.topology.num_bonds   = len(bonds)
+        self.topology.bond_list   = bonds.astype(index_dtype(self.num_atoms)).ravel()
+        self.topology.bond_matrix = None
+        self.build_bond_graph()
+
+    def get_bond_matrix(self):
+        if self.topology.bond_matrix is None:
+            bonds = np.asarray(self.topology.bond_list, dtype=np.int64).reshape(-1, 2) - 1
+            self.topology.bond_matrix = np.zeros(Trimatrix.get_size(self.num_atoms), dtype=bool)
+            self.topology.bond_matrix[Trimatrix.get_indices(bonds[:, 0], bonds[:, 1])] = True
+        return self.topology.bond_matrix
+
+    def build_bond_graph(self):
+        bonds = np.asarray(self.topology.bond_list, dtype=np.intp).reshape(-1, 2) - 1
+        self.topology.bond_graph = BondGraph(self.num_atoms, bonds)
+
+    def get_bond_graph(self):
+        if self.topology.bond_graph is None:
+            self.build_bond_graph()
+        return self.topology.bond_graph
 
     def get_bond_list(self, a):
-        blist = []
-        a = a-1
-        k = int(a*(a-1)/2)
-
-        for i in range(a):
-            if self.topology.bond_matrix[k+i]:
-                blist.append(i+1)
-
-        for i in range(a+1, self.num_atoms):
-            if self.topology.bond_matrix[int(i*(i-1)/2 + a)]:
-                blist.append(i+1)
-
-        return blist
+        # 1-based numbers of the atoms bonded to atom a (1-based)
+        return (self.get_bond_graph().get_neighbors(a-1) + 1).tolist()
 
     def get_angle_list(self, a):
         alist = []
@@ -435,35 +528,20 @@ class Molecule:
         return dlist
 
     def gen_angle_list_from_bond_list(self):
-        nbonds = self.topology.num_bonds
-        for i in range(0, nbonds*2, 2):
-            for j in range(i+2, nbonds*2, 2):
-                if self.topology.bond_list[j] == self.topology.bond_list[i+1]:
-                    self.topology.angle_list.append(self.topology.bond_list[i])
-                    self.topology.angle_list.append(self.topology.bond_list[i+1])
-                    self.topology.angle_list.append(self.topology.bond_list[j+1])
-                elif self.topology.bond_list[j] == self.topology.bond_list[i]:
-                    self.topology.angle_list.append(self.topology.bond_list[i+1])
-                    self.topology.angle_list.append(self.topology.bond_list[i])
-                    self.topology.angle_list.append(self.topology.bond_list[j+1])
-        self.topology.num_angles = int(len(self.topology.angle_list)/3)
+        # Angles are enumerated from the bond graph as pairs of neighbors of 
+        # each center atom, in linear time
+        angles = self.get_bond_graph().get_angles()
+        self.topology.angle_list = (angles + 1).astype(index_dtype(self.num_atoms)).ravel()
+        self.topology.num_angles = len(angles)
+        self.topology.parameters_assigned = False
 
     def gen_dihed_list_from_angle_list(self):
+        # Proper dihedrals are enumerated from the bond graph as the products 
+        # of the neighbors of both atoms of each bond, in linear time
         if self.topology.num_angles == 0:
             self.gen_angle_list_from_bond_list()
-        nangles = self.topology.num_angles
-        for i in range(0, nangles*3, 3):
-            for j in range(i+3, nangles*3, 3):
-                if(self.topology.angle_list[j+1] == self.topology.angle_list[i] and
-                        self.topology.angle_list[j] == self.topology.angle_list[i+1]):
-                    self.topology.dihedral_list.append(self.topology.angle_list[i+2])
-                    self.topology.dihedral_list.append(self.topology.angle_list[j])
-                    self.topology.dihedral_list.append(self.topology.angle_list[i])
-                    self.topology.dihedral_list.append(self.topology.angle_list[j+2])
-                elif(self.topology.angle_list[j] == self.topology.angle_list[i+1] and
-                        self.topology.angle_list[j+1] == self.topology.angle_list[i+2]):
-                    self.topology.dihedral_list.append(self.topology.angle_list[i])
-                    self.topology.dihedral_list.append(self.topology.angle_list[j])
-                    self.topology.dihedral_list.append(self.topology.angle_list[j+1])
-                    self.topology.dihedral_list.append(self.topology.angle_list[j+2])
-        self.topology.num_dihedrals = int(len(self.topology.dihedral_list)/4)
+        bonds = np.asarray(self.topology.bond_list, dtype=np.intp).reshape(-1, 2) - 1
+        dihedrals = self.get_bond_graph().get_dihedrals(bonds)
+        self.topology.dihedral_list = (dihedrals + 1).astype(index_dtype(self.num_atoms)).ravel()
+        self.topology.num_dihedrals = len(dihedrals)
+        self.topology.parameters_assigned = False
@@ -1,3 +1,5 @@
+import numpy as np
+
 class Trimatrix:
 
     @staticmethod
@@ -7,3 +9,8 @@ class Trimatrix:
     @staticmethod
     def get_index(i, j):  # conditions: i != j and (i, j) < dimension
         return int((i*(i-1)/2) + j) if i > j else int((j*(j-1)/2) + i)
+
+    @staticmethod
+    def get_indices(i, j):  # get_index for arrays of indices (numpy integer arrays)
+        high = np.maximum(i, j)
+        return high * (high - 1) // 2 + np.minimum(i, j)
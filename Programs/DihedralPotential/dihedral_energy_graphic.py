@@ -4,14 +4,27 @@ import matplotlib.pyplot as plt
 import rotate
 import DihedralPotential.dihedral_potential_energy as dihedral_potential_energy
 import DihedralPotential.plot_PE as plot_PE
+import DihedralPotential.incremental_dihedral_potential as incremental_dihedral_potential
+import DihedralPotential.dihedral_energy_profile as dihedral_energy_profile
 import DihedralPotential.get_dihedral_angle as get_dihedral_angle
 import get_bond_vector
+import IO.trajectory as trajectory
 
 def dihedral_energy_graphic(molecule, a, b, c, d, theta, ntimes, pdf_name,
-                       write_mol2=False, mol2_name=None):
+                       write_mol2=False, mol2_name=None, closed_form=False, frames=None):
+    if closed_form:
+        # whole scan in one array operation; the molecule is not rotated and
+        # only the steps in frames are written (all of them with write_mol2)
+        if write_mol2 and frames is None:
+            frames = range(ntimes + 1)
+        dihed_angle, Vd = dihedral_energy_profile.dihedral_energy_profile(
+            molecule, a, b, c, d, theta, ntimes, frames, mol2_name)
+        plt.scatter(dihed_angle, Vd, marker='.', color='royalblue')
+        plot_PE.plot_PE(theta, ntimes, pdf_name)
+        return dihed_angle, Vd
     times = ntimes + 1
-    Vd = np.zeros(times, dtype='float32')
-    dihed_angle = np.zeros(times, dtype='float32')
+    Vd = np.zeros(times, dtype=molecule.accum_dtype)
+    dihed_angle = np.zeros(times, dtype=molecule.accum_dtype)
     Vd[0] = dihedral_potential_energy.total_dihedral_potential(molecule)
     v21x, v21y, v21z = get_bond_vector.get_bond_vector_v12(molecule, b-1, a-1)
     v23x, v23y, v23z = get_bond_vector.get_bond_vector_v12(molecule, b-1, c-1)
@@ -19,13 +32,15 @@ def dihedral_energy_graphic(molecule, a, b, c, d, theta, ntimes, pdf_name,
     angle_rad = get_dihedral_angle.get_dihedral_angle(v21x, v21y, v21z, v23x, v23y, v23z, v34x, v34y, v34z)
     dihed_angle[0] = angle_rad * 180 / np.pi
     plt.scatter(dihed_angle[0], Vd[0], marker='.', color='royalblue')
-    rotate.init_rotation_axis(molecule, b-1, c-1, theta)
-    rlist = rotate.get_rotation_list(molecule, b-1, c-1)
+    origin, axis = rotate.get_rotation_axis(molecule, b-1, c-1)
+    matrix = rotate.rotation_matrix(axis, theta)
+    rlist = rotate.get_rotation_list(molecule, b, c)  # 1-based atom numbers
+    # only the dihedrals across the bond b-c are re-evaluated at each step
+    cache = incremental_dihedral_potential.DihedralEnergyCache(molecule)
     if not write_mol2:
         for i in range(1, times):
-            for atom in rlist:
-                rotate.rotate_atom(molecule, atom)
-            Vd[i] = dihedral_potential_energy.total_dihedral_potential(molecule)
+            rotate.rotate_atoms(molecule, rlist, origin, matrix)
+            Vd[i] = cache.update(b-1, c-1, rlist)
             v21x, v21y, v21z = get_bond_vector.get_bond_vector_v12(molecule, b-1, a-1)
             v23x, v23y, v23z = get_bond_vector.get_bond_vector_v12(molecule, b-1, c-1)
             v34x, v34y, v34z = get_bond_vector.get_bond_vector_v12(molecule, c-1, d-1)
@@ -33,17 +48,18 @@ def dihedral_energy_graphic(molecule, a, b, c, d, theta, ntimes, pdf_name,
             dihed_angle[i] = angle_rad * 180 / np.pi
             plt.scatter(dihed_angle[i], Vd[i], marker='.', color='royalblue')
     else:
-        molecule.write_mol2(mol2_name, 'w+')
+        writer = trajectory.Mol2TrajectoryWriter(molecule, mol2_name, 'w+')
+        writer.write_frame()
         for i in range(1, times):
-            for atom in rlist:
-                rotate.rotate_atom(molecule, atom)
-            Vd[i] = dihedral_potential_energy.total_dihedral_potential(molecule)
+            rotate.rotate_atoms(molecule, rlist, origin, matrix)
+            Vd[i] = cache.update(b-1, c-1, rlist)
             v21x, v21y, v21z = get_bond_vector.get_bond_vector_v12(molecule, b-1, a-1)
             v23x, v23y, v23z = get_bond_vector.get_bond_vector_v12(molecule, b-1, c-1)
             v34x, v34y, v34z = get_bond_vector.get_bond_vector_v12(molecule, c-1, d-1)
             angle_rad = get_dihedral_angle.get_dihedral_angle(v21x, v21y, v21z, v23x, v23y, v23z, v34x, v34y, v34z)
             dihed_angle[i] = angle_rad * 180 / np.pi
             plt.scatter(dihed_angle[i], Vd[i], marker='.', color='royalblue')
-            molecule.write_mol2(mol2_name, 'a')
+            writer.write_frame()
+        writer.close()
     plot_PE.plot_PE(theta, ntimes, pdf_name)
     return dihed_angle, Vd
\ No newline at end of file
@@ -0,0 +1,90 @@
+import numpy as np
+
+import rotate
+import BatchedPotential.batched_potential_energy as batched_potential_energy
+import IO.trajectory as trajectory
+
+# Closed-form torsion profile. A rigid rotation by theta of the atoms on one
+# side of the bond b-c changes only the dihedrals centered on b-c, and each of
+# them by exactly +theta or -theta (the sign depends on the order of its atoms
+# and on which side moves). The dihedral energy over a whole grid of rotation
+# angles is then a cos-series of the starting dihedral angles, evaluated as
+# one broadcast array operation without moving any atom.
+
+def get_torsion_terms(molecule, b, c, rlist=None):
+    # Terms of the dihedrals that change in a rotation around the bond b-c
+    # (0-based), as (phi0, sign, term_dihedral, Vn, phase, n, constant): the
+    # starting angle of those dihedrals, the direction in which they turn,
+    # their Fourier terms and the energy of all the other dihedrals
+    if rlist is None:
+        rlist = rotate.get_rotation_list(molecule, b+1, c+1)
+    top = batched_potential_energy.get_parameters(molecule)
+    coords = batched_potential_energy.get_coordinates(molecule)
+    energies = batched_potential_energy.dihedral_energies(
+        coords, top.dihedral_index, top.dihedral_term, top.dihedral_Vn,
+        top.dihedral_phase, top.dihedral_n)
+    index = top.dihedral_index
+    moving = np.zeros(molecule.num_atoms, dtype=bool)
+    moving[np.asarray(rlist, dtype=np.intp)] = True
+    moving[[b, c]] = False
+    fixed = ~moving
+    fixed[[b, c]] = False
+    rows = np.flatnonzero(moving[index].any(axis=1) & fixed[index].any(axis=1))
+    dihedrals, term_dihedral, Vn, phase, n = batched_potential_energy.select_dihedrals(top, rows)
+    center = np.sort(dihedrals[:, 1:3], axis=1)
+    if (center != sorted((b, c))).any():
+        # the moving side reaches back to b: the rotation is not rigid
+        raise ValueError('Bond {}-{} belongs to a ring'.format(b+1, c+1))
+    phi0 = batched_potential_energy.dihedral_values(coords, dihedrals)
+    # direction of each dihedral, from a trial rotation of its four atoms
+    origin, axis = rotate.get_rotation_axis(molecule, b, c)
+    trial = coords[dihedrals]
+    ends = moving[dihedrals]
+    trial[ends] = (trial[ends] - origin) @ rotate.rotation_matrix(axis, 0.5).T + origin
+    local = np.arange(4 * len(dihedrals)).reshape(-1, 4)
+    delta = batched_potential_energy.dihedral_values(trial.reshape(-1, 3), local) - phi0
+    sign = np.where(np.sin(delta) > 0, 1.0, -1.0)
+    constant = float(energies.sum() - energies[rows].sum())
+    return phi0, sign, term_dihedral, Vn, phase, n, constant
+
+def torsion_profile(terms, angles):
+    # Total dihedral energy after a rotation by each of the angles (radians)
+    phi0, sign, term_dihedral, Vn, phase, n, constant = terms
+    phi = phi0 + sign * np.asarray(angles, dtype=np.float64)[:, None]
+    energies = batched_potential_energy.dihedral_term_energies(phi, term_dihedral, Vn, phase, n)
+    return energies.sum(axis=-1) + constant
+
+def dihedral_energy_profile(molecule, a, b, c, d, theta, ntimes, frames=None, mol2_name=None,
+                            store=None):
+    # Same (dihed_angle, Vd) arrays as dihedral_energy_graphic, computed in
+    # closed form. The molecule is left unchanged; the coordinates of the
+    # steps in frames (if any) are written to mol2_name and/or to store (an
+    # IO.conformer_store.ConformerStore open for writing), with their energies.
+    times = ntimes + 1
+    angles = theta * np.arange(times)
+    rlist = rotate.get_rotation_list(molecule, b, c)  # 1-based atom numbers
+    terms = get_torsion_terms(molecule, b-1, c-1, rlist)
+    Vd = torsion_profile(terms, angles).astype(molecule.accum_dtype)
+    coords = batched_potential_energy.get_coordinates(molecule)
+    phi0 = batched_potential_energy.dihedral_values(coords, np.array([[a-1, b-1, c-1, d-1]]))[0]
+    # a-b-c-d turns like any other dihedral centered on b-c
+    origin, axis = rotate.get_rotation_axis(molecule, b-1, c-1)
+    trial = coords.copy()
+    rotate.rotate_coordinates(trial, rlist, origin, rotate.rotation_matrix(axis, 0.5))
+    delta = batched_potential_energy.dihedral_values(trial, np.array([[a-1, b-1, c-1, d-1]]))[0] - phi0
+    sign = 1.0 if np.sin(delta) > 0 else -1.0
+    dihed_angle = np.angle(np.exp(1j * (phi0 + sign * angles)), deg=True).astype(molecule.accum_dtype)
+    if frames is not None and (mol2_name is not None or store is not None):
+        writer = None
+        if mol2_name is not None:
+            writer = trajectory.Mol2TrajectoryWriter(molecule, mol2_name, 'w+')
+        for i in frames:
+            frame = coords.copy()
+            rotate.rotate_coordinates(frame, rlist, origin, rotate.rotation_matrix(axis, angles[i]))
+            if writer is not None:
+                writer.write_frame(frame)
+            if store is not None:
+                store.write_frame(frame, Vd[i])
+        if writer is not None:
+            writer.close()
+    return dihed_angle, Vd
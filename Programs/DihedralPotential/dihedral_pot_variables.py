@@ -5,18 +5,10 @@ import DihedralPotential.get_dihedral_angle as get_dihedral_angle
 import DihedralPotential.get_dihedral_type as get_dihedral_type
 
 def _dihedral_pot_variables(molecule, atom1, atom2, atom3, atom4, dtype):
-    x1 = molecule.x[atom1]
-    y1 = molecule.y[atom1]
-    z1 = molecule.z[atom1]
-    x2 = molecule.x[atom2]
-    y2 = molecule.y[atom2]
-    z2 = molecule.z[atom2]
-    x3 = molecule.x[atom3]
-    y3 = molecule.y[atom3]
-    z3 = molecule.z[atom3]
-    x4 = molecule.x[atom4]
-    y4 = molecule.y[atom4]
-    z4 = molecule.z[atom4]
+    x1, y1, z1 = molecule.coords[atom1]
+    x2, y2, z2 = molecule.coords[atom2]
+    x3, y3, z3 = molecule.coords[atom3]
+    x4, y4, z4 = molecule.coords[atom4]
 
     v21x = x1 - x2
     v21y = y1 - y2
@@ -0,0 +1,60 @@
+import numpy as np
+
+import BatchedPotential.batched_potential_energy as batched_potential_energy
+import profiling
+
+# Incremental dihedral energy for torsion scans. The energy of every dihedral is
+# cached; after the atoms on one side of the bond b-c are rotated, only the
+# dihedrals with atoms on both sides of the bond are evaluated again. Bond and
+# angle energies do not change in such a rotation, and neither do the
+# dihedrals that lie entirely on one side of it.
+
+class DihedralEnergyCache:
+    def __init__(self, molecule):
+        self.molecule = molecule
+        top = batched_potential_energy.get_parameters(molecule)
+        coords = batched_potential_energy.get_coordinates(molecule)
+        self.energies = batched_potential_energy.dihedral_energies(
+            coords, top.dihedral_index, top.dihedral_term, top.dihedral_Vn,
+            top.dihedral_phase, top.dihedral_n)
+        self.total = float(self.energies.sum())
+        self._affected = {}  # (b, c) -> dihedrals changed by a rotation around b-c
+
+    def get_affected(self, b, c, moving):
+        # Rows of the parameter tables of the dihedrals that change when the
+        # atoms in moving (0-based) rotate around the bond b-c, together with
+        # what is needed to evaluate only them: the atoms they use and the
+        # dihedrals and Fourier terms renumbered to those atoms.
+        key = (int(b), int(c))
+        if key not in self._affected:
+            top = self.molecule.topology
+            side = np.zeros(self.molecule.num_atoms, dtype=np.int8)
+            side[np.asarray(moving, dtype=np.intp)] = 1
+            side[[b, c]] = 0
+            fixed = np.ones(self.molecule.num_atoms, dtype=bool)
+            fixed[np.asarray(moving, dtype=np.intp)] = False
+            fixed[[b, c]] = False
+            index = top.dihedral_index
+            rows = np.flatnonzero(side[index].any(axis=1) & fixed[index].any(axis=1))
+            dihedrals, term_dihedral, Vn, phase, n = batched_potential_energy.select_dihedrals(top, rows)
+            atoms, local = np.unique(dihedrals, return_inverse=True)
+            self._affected[key] = (rows, atoms, local.reshape(-1, 4), term_dihedral, Vn, phase, n)
+        return self._affected[key]
+
+    def update(self, b, c, moving):
+        # Re-evaluates the dihedrals affected by a rotation around b-c, and
+        # returns the new total dihedral energy
+        rows, atoms, local, term_dihedral, Vn, phase, n = self.get_affected(b, c, moving)
+        profiling.count('DihedralEnergyCache.dihedrals', len(rows))
+        if len(rows) == 0:
+            return self.total
+        molecule = self.molecule
+        coords = molecule.coords[atoms].astype(molecule.accum_dtype)
+        energies = batched_potential_energy.dihedral_energies(
+            coords, local, term_dihedral, Vn, phase, n)
+        self.total += float(energies.sum() - self.energies[rows].sum())
+        self.energies[rows] = energies
+        return self.total
+
+    def get_total(self):
+        return self.total
@@ -0,0 +1,146 @@
+import json
+import os
+
+import numpy as np
+
+from Classes.Molecule import Molecule, index_dtype
+import BatchedPotential.batched_potential_energy as batched_potential_energy
+import IO.trajectory as trajectory
+
+# On-disk store of the conformers of one molecule, as a directory with
+#   topology.json  atoms, types, charges, bonds and the tracked dihedrals
+#   coords.npy     (K, natoms, 3) float32 coordinates
+#   energies.npy   (K,) float64 energy of each frame
+#   dihedrals.npy  (K, D) float64 value (degrees) of each tracked dihedral
+# The arrays are appended frame by frame while a scan runs (their headers are
+# updated on flush) and opened read-only as memory maps, so any frame can be
+# read without loading or parsing the rest.
+
+VERSION = 1
+
+def _topology(molecule, dihedrals):
+    top = molecule.topology
+    return {
+        'version': VERSION,
+        'num_atoms': molecule.num_atoms,
+        'atom': [str(a) for a in molecule.atom],
+        'atom_type': [str(a) for a in molecule.atom_type],
+        'subst_id': [int(i) for i in top.subst_id],
+        'subst_name': [str(a) for a in top.subst_name],
+        'charge': [float(q) for q in top.charge],
+        'bond_list': [int(i) for i in top.bond_list],
+        'num_subst': int(top.num_subst),
+        'num_feat': int(top.num_feat),
+        'num_sets': int(top.num_sets),
+        'substructures': [str(s) for s in top.substructures],
+        'molecule_type': molecule.molecule_type,
+        'charge_type': molecule.charge_type,
+        'dihedrals': dihedrals.tolist(),  # 0-based
+    }
+
+class ConformerStore:
+    def __init__(self, path, mode='r'):
+        # mode 'r' opens the arrays as read-only memory maps, 'a' appends to
+        # an existing store (see create_store for a new one)
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path, 'topology.json')) as inf:
+            self.topology = json.load(inf)
+        if self.topology['version'] != VERSION:
+            raise ValueError('Unsupported conformer store version: {}'.format(self.topology['version']))
+        self.num_atoms = self.topology['num_atoms']
+        self.dihedral_index = np.array(self.topology['dihedrals'], dtype=np.intp).reshape(-1, 4)
+        self.writers = None
+        if mode == 'a':
+            self._open_writers(append=True)
+
+    def _file(self, name):
+        return os.path.join(self.path, name + '.npy')
+
+    def _open_writers(self, append):
+        self.writers = (
+            trajectory.NpyTrajectoryWriter(self._file('coords'), self.num_atoms, 'float32', append),
+            trajectory.NpyArrayWriter(self._file('energies'), (), 'float64', append),
+            trajectory.NpyArrayWriter(self._file('dihedrals'), (len(self.dihedral_index),), 'float64', append))
+
+    def write_frame(self, coords, energies=None):
+        # Appends one (natoms, 3) conformer or a (K, natoms, 3) stack, with
+        # its energies (NaN if not given); the tracked dihedrals are measured
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, self.num_atoms, 3)
+        if energies is None:
+            energies = np.full(len(coords), np.nan)
+        angles = np.degrees(batched_potential_energy.dihedral_values(coords, self.dihedral_index))
+        coords_writer, energies_writer, dihedrals_writer = self.writers
+        coords_writer.write_frame(coords)
+        energies_writer.write_frame(np.asarray(energies, dtype=np.float64).reshape(-1))
+        dihedrals_writer.write_frame(angles.reshape(len(coords), -1))
+
+    def flush(self):
+        # Makes the frames written so far visible to readers
+        for writer in self.writers:
+            writer.flush()
+
+    def close(self):
+        if self.writers is not None:
+            for writer in self.writers:
+                writer.close()
+            self.writers = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _load(self, name):
+        return np.load(self._file(name), mmap_mode='r')
+
+    # memory maps of the flushed frames (no copies)
+    coords    = property(lambda self: self._load('coords'))
+    energies  = property(lambda self: self._load('energies'))
+    dihedrals = property(lambda self: self._load('dihedrals'))
+
+    def __len__(self):
+        return len(self.energies)
+
+    def __getitem__(self, k):
+        return self.coords[k]
+
+    def get_molecule(self, k=0):
+        # Molecule with the topology of the store and the coordinates of frame k;
+        # the angles and dihedrals are generated from the bonds, as parse_mol2 does
+        top = self.topology
+        molecule = Molecule()
+        natoms = molecule.num_atoms = top['num_atoms']
+        molecule.atom = np.array(top['atom'])
+        molecule.atom_type = np.array(top['atom_type'])
+        molecule.coords = np.array(self.coords[k], dtype=molecule.float_dtype)
+        molecule.molecule_type, molecule.charge_type = top['molecule_type'], top['charge_type']
+        t = molecule.topology
+        t.subst_id = np.array(top['subst_id']).astype(index_dtype(natoms))
+        t.subst_name = np.array(top['subst_name'])
+        t.charge = np.array(top['charge'], dtype=molecule.float_dtype)
+        t.bond_list = np.array(top['bond_list']).astype(index_dtype(natoms))
+        t.num_bonds = len(t.bond_list) // 2
+        t.num_subst, t.num_feat, t.num_sets = top['num_subst'], top['num_feat'], top['num_sets']
+        t.substructures = list(top['substructures'])
+        molecule.build_bond_graph()
+        molecule.gen_dihed_list_from_angle_list()
+        return molecule
+
+def create_store(path, molecule, dihedrals=None):
+    # New, empty store for conformers of molecule, tracking the given
+    # (D, 4) 0-based dihedrals (all the dihedrals of the molecule by default)
+    if dihedrals is None:
+        dihedrals = batched_potential_energy.get_index_array(molecule.topology.dihedral_list, 4)
+    dihedrals = np.asarray(dihedrals, dtype=np.intp).reshape(-1, 4)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'topology.json'), 'w') as outf:
+        json.dump(_topology(molecule, dihedrals), outf)
+    store = ConformerStore(path, 'r')
+    store.mode = 'a'
+    store._open_writers(append=False)
+    return store
+
+def open_store(path, mode='r'):
+    return ConformerStore(path, mode)
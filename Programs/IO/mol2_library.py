@@ -0,0 +1,87 @@
+import numpy as np
+
+from Classes.Molecule import Molecule
+
+# Streaming access to multi-molecule mol2 files (screening libraries). The file
+# is read in fixed-size chunks and one Molecule is parsed at a time, so memory
+# stays bounded by the chunk size plus the largest molecule. A byte-offset
+# index (index_mol2) lets a worker seek straight to molecule k.
+
+MARKER = b'@<TRIPOS>MOLECULE'
+CHUNK_SIZE = 1 << 20
+
+def index_mol2(filename, chunk_size=CHUNK_SIZE):
+    # Byte offsets of every @<TRIPOS>MOLECULE record of the file
+    offsets = []
+    position = 0  # file position of buffer[0]
+    buffer = b''
+    with open(filename, 'rb') as inf:
+        while True:
+            chunk = inf.read(chunk_size)
+            if not chunk:
+                break
+            buffer += chunk
+            k = buffer.find(MARKER)
+            while k >= 0:
+                offsets.append(position + k)
+                k = buffer.find(MARKER, k + 1)
+            # keep just enough bytes to find a marker split between chunks
+            keep = min(len(buffer), len(MARKER) - 1)
+            position += len(buffer) - keep
+            buffer = buffer[len(buffer) - keep:]
+    return np.array(offsets, dtype=np.int64)
+
+def _read_blocks(inf, chunk_size):
+    # Yields the bytes of one molecule record at a time, from its
+    # @<TRIPOS>MOLECULE line up to the next one (or the end of the file)
+    buffer = b''
+    start = -1
+    while True:
+        chunk = inf.read(chunk_size)
+        buffer += chunk
+        if start < 0:
+            start = buffer.find(MARKER)
+            if start < 0:
+                # keep just enough bytes to find a marker split between chunks
+                keep = min(len(buffer), len(MARKER) - 1)
+                buffer = buffer[len(buffer) - keep:] if chunk else b''
+                if not chunk:
+                    return
+                continue
+        end = buffer.find(MARKER, start + 1)
+        while end >= 0:
+            yield buffer[start:end]
+            start = end
+            end = buffer.find(MARKER, start + 1)
+        buffer = buffer[start:]
+        start = 0
+        if not chunk:
+            yield buffer
+            return
+
+def iter_mol2(filename, offsets=None, start=0, count=None, chunk_size=CHUNK_SIZE,
+              precision='mixed'):
+    # Generator of the molecules of a mol2 file, starting from molecule start.
+    # With offsets (from index_mol2) the file is seeked straight to it.
+    with open(filename, 'rb') as inf:
+        skip = start
+        if offsets is not None:
+            if start >= len(offsets):
+                return
+            inf.seek(int(offsets[start]))
+            skip = 0
+        n = 0
+        for block in _read_blocks(inf, chunk_size):
+            if skip > 0:
+                skip -= 1
+                continue
+            if count is not None and n >= count:
+                return
+            molecule = Molecule(precision)
+            molecule.parse_mol2(block.decode())
+            yield molecule
+            n += 1
+
+def read_mol2_at(filename, offsets, k):
+    # Molecule k of the file, given the offsets from index_mol2
+    return next(iter_mol2(filename, offsets, start=k, count=1))
@@ -0,0 +1,175 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+from Classes.BondGraph import BondGraph
+import Classes.ForceField as ForceField
+import BatchedPotential.batched_potential_energy as batched_potential_energy
+from NonbondedPotential.neighbor_list import NeighborList
+
+# Binary snapshot of a prepared molecule: coordinates, typed topology arrays,
+# resolved parameter tables and the bond graph, in one flat file
+#   MAGIC (8 bytes), header length (uint64, little endian), JSON header
+#   arrays, each starting at a multiple of ALIGNMENT bytes
+# Array offsets in the header are counted from the end of the header.
+# The header holds the scalars, the force field dictionaries and, for every
+# array, its dtype, shape and offset. Loading parses the header and maps the
+# file once; every array is a view of that map, so nothing is parsed or
+# copied and reload time does not grow with the size of the molecule.
+# The header may also record the files the molecule was prepared from
+# ('source'), so that a reader can check that a snapshot belongs to them.
+
+MAGIC = b'MOLSNAP\x00'
+VERSION = 1
+ALIGNMENT = 64
+
+MOLECULE_ARRAYS = ('id', 'atom', 'atom_type', 'alt_loc', 'residue', 'chain', 'res_num',
+                   'ins_code', 'coords', 'occup', 'temp', 'element', 'charge')
+TOPOLOGY_ARRAYS = ('segid', 'resid', 'resname', 'name', 'charge', 'mass', 'subst_id',
+                   'subst_name', 'bond_list', 'angle_list', 'dihedral_list',
+                   'bond_index', 'bond_Kb', 'bond_b0', 'angle_index', 'angle_Ka', 'angle_a0',
+                   'dihedral_index', 'dihedral_ptr', 'dihedral_term', 'dihedral_Vn',
+                   'dihedral_phase', 'dihedral_n', 'nonbonded_Rmin', 'nonbonded_epsilon',
+                   'nonbonded_charge', 'excluded_pairs', 'pairs14')
+TOPOLOGY_SCALARS = ('num_subst', 'num_feat', 'num_sets', 'num_bonds', 'num_angles',
+                    'num_dihedrals', 'parameters_assigned')
+TYPES = ('bond_types', 'angle_types', 'dihedral_types', 'nonbonded_types')
+
+def _align(n):
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+def _arrays(molecule):
+    # (name, array) of everything stored as an array; attributes still at
+    # their empty-list defaults (e.g. PDB fields of a mol2 molecule) are skipped
+    top = molecule.topology
+    for owner, prefix, names in ((molecule, 'molecule', MOLECULE_ARRAYS),
+                                 (top, 'topology', TOPOLOGY_ARRAYS)):
+        for name in names:
+            value = getattr(owner, name)
+            if value is None or (isinstance(value, list) and not value):
+                continue
+            yield '{}.{}'.format(prefix, name), np.ascontiguousarray(value)
+    graph = molecule.get_bond_graph()
+    yield 'graph.neighbors', graph.neighbors
+    yield 'graph.offsets', graph.offsets
+    if top.neighbor_list is not None:
+        yield 'neighbor_list.excluded', np.ascontiguousarray(top.neighbor_list.excluded)
+
+def write_snapshot(molecule, filename, source=None):
+    # Parameters are resolved first if the molecule has force field types, so
+    # that the snapshot holds the tables the energy routines use
+    top = molecule.topology
+    if not top.parameters_assigned and molecule.forcefield is not None:
+        molecule.assign_parameters()
+    arrays = list(_arrays(molecule))
+    entries = []
+    offset = 0
+    for name, array in arrays:
+        if array.dtype.hasobject:
+            raise ValueError('Cannot store object array {}'.format(name))
+        entries.append({'name': name, 'dtype': array.dtype.str, 'shape': list(array.shape),
+                        'offset': offset})
+        offset = _align(offset + array.nbytes)
+    neighbor_list = None
+    if top.neighbor_list is not None:
+        neighbor_list = {'cutoff': top.neighbor_list.cutoff, 'skin': top.neighbor_list.skin}
+    forcefield = None
+    if molecule.forcefield is not None:
+        forcefield = {'filename': molecule.forcefield.filename, 'digest': molecule.forcefield.digest}
+    header = {
+        'version': VERSION,
+        'precision': molecule.precision,
+        'num_atoms': int(molecule.num_atoms),
+        'molecule_type': molecule.molecule_type,
+        'charge_type': molecule.charge_type,
+        'substructures': [str(s) for s in top.substructures],
+        'topology': {name: getattr(top, name) for name in TOPOLOGY_SCALARS},
+        'types': {name: getattr(top, name) for name in TYPES},
+        'forcefield': forcefield,
+        'neighbor_list': neighbor_list,
+        'source': source,
+        'arrays': entries,
+    }
+    text = json.dumps(header, default=int).encode()
+    start = _align(len(MAGIC) + 8 + len(text))
+    text = text.ljust(start - len(MAGIC) - 8)
+    # written to a temporary file and renamed, so that readers never map a
+    # partial snapshot
+    temporary = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(temporary, 'wb') as outf:
+        outf.write(MAGIC)
+        outf.write(struct.pack('<Q', len(text)))
+        outf.write(text)
+        for entry, (name, array) in zip(entries, arrays):
+            outf.seek(start + entry['offset'])
+            outf.write(array.tobytes())
+        outf.truncate(start + offset)
+    os.replace(temporary, filename)
+
+def read_header(filename):
+    with open(filename, 'rb') as inf:
+        if inf.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a molecule snapshot'.format(filename))
+        length, = struct.unpack('<Q', inf.read(8))
+        header = json.loads(inf.read(length).decode())
+    if header['version'] != VERSION:
+        raise ValueError('Unsupported snapshot version: {}'.format(header['version']))
+    header['start'] = len(MAGIC) + 8 + length
+    return header
+
+def read_snapshot(molecule, filename, mmap_mode='c'):
+    # Fills molecule from the snapshot. With mmap_mode 'c' (copy-on-write)
+    # the arrays can be modified in memory without changing the file, with
+    # 'r' they are read-only, and with None the file is read into memory.
+    header = read_header(filename)
+    if mmap_mode is None:
+        data = np.fromfile(filename, dtype=np.uint8)
+    else:
+        data = np.memmap(filename, dtype=np.uint8, mode=mmap_mode)
+    arrays = {}
+    for entry in header['arrays']:
+        dtype = np.dtype(entry['dtype'])
+        size = dtype.itemsize * int(np.prod(entry['shape'], dtype=np.int64))
+        start = header['start'] + entry['offset']
+        arrays[entry['name']] = data[start:start+size].view(dtype).reshape(entry['shape'])
+
+    molecule.set_precision(header['precision'])
+    molecule.num_atoms = header['num_atoms']
+    molecule.molecule_type = header['molecule_type']
+    molecule.charge_type = header['charge_type']
+    for name in MOLECULE_ARRAYS:
+        setattr(molecule, name, [])
+    molecule.coords = np.zeros((0, 3), dtype=molecule.float_dtype)
+    top = molecule.Topology()
+    molecule.topology = top
+    for name, array in arrays.items():
+        prefix, _, attribute = name.partition('.')
+        if prefix == 'molecule':
+            setattr(molecule, attribute, array)
+        elif prefix == 'topology':
+            setattr(top, attribute, array)
+    for name, value in header['topology'].items():
+        setattr(top, name, value)
+    for name, value in header['types'].items():
+        setattr(top, name, value)
+    top.substructures = list(header['substructures'])
+    top.bond_graph = BondGraph.from_arrays(molecule.num_atoms, arrays['graph.neighbors'],
+                                           arrays['graph.offsets'])
+    if top.dihedral_index is not None:
+        top.dihedral_rows = batched_potential_energy.dihedral_rows(top.dihedral_index)
+    if header['neighbor_list'] is not None:
+        top.neighbor_list = NeighborList(header['neighbor_list']['cutoff'],
+                                         header['neighbor_list']['skin'],
+                                         arrays['neighbor_list.excluded'])
+    molecule.forcefield = None
+    if header['forcefield'] is not None:
+        # a ForceField with the dictionaries the parameters were resolved from
+        forcefield = ForceField.ForceField()
+        forcefield.filename = header['forcefield']['filename']
+        forcefield.digest = header['forcefield']['digest']
+        for name in TYPES:
+            setattr(forcefield, name, getattr(top, name))
+        molecule.forcefield = forcefield
+    return molecule
@@ -0,0 +1,126 @@
+import numpy as np
+
+import BatchedPotential.batched_potential_energy as batched_potential_energy
+
+# Multi-frame trajectory writers that keep their file open for the whole scan.
+# Mol2TrajectoryWriter writes one full mol2 record per frame, as
+# Molecule.write_mol2(filename, 'a') does, but formats the constant parts of the
+# record once and each frame with a single format call over all coordinates.
+# NpyTrajectoryWriter appends float32 frames to a (K, natoms, 3) .npy stack
+# (NpyArrayWriter does the same for frames of any shape), which
+# np.load(filename, mmap_mode='r') opens without parsing any text.
+
+def _escape(text):
+    return text.replace('{', '{{').replace('}', '}}')
+
+class Mol2TrajectoryWriter:
+    def __init__(self, molecule, filename, mode='w'):
+        self.molecule = molecule
+        self.num_frames = 0
+        self.outf = open(filename, mode)
+        top = molecule.topology
+        natoms = molecule.num_atoms
+        nbonds = top.num_bonds
+        header = '@<TRIPOS>MOLECULE\nMOL\n'
+        header += '{:>5d} {:>5d}'.format(natoms, nbonds)
+        header += ' {:>5} {:>5} {:>5}\n'.format(top.num_subst, top.num_feat, top.num_sets)
+        header += '{}\n{}\n\n\n'.format(molecule.molecule_type, molecule.charge_type)
+        header += '@<TRIPOS>ATOM\n'
+        # Same columns as write_mol2, with the coordinates left as fields
+        atoms = ''.join(
+            _escape('{0:>4} {1:>4} '.format(i+1, molecule.atom[i])) +
+            '{:>13.4f} {:>9.4f} {:>9.4f}' +
+            _escape(' {0:>4} {1} {2} {3:>7.4f}\n'.format(
+                molecule.atom_type[i], top.subst_id[i], top.subst_name[i], top.charge[i]))
+            for i in range(natoms))
+        tail = '@<TRIPOS>BOND\n'
+        tail += ''.join('{0:>5} {1:>5} {2:>5} {3:>2}\n'.format(
+            i+1, top.bond_list[2*i], top.bond_list[2*i+1], 1) for i in range(nbonds))
+        if top.num_subst != 0:
+            tail += '@<TRIPOS>SUBSTRUCTURE\n'
+            tail += ''.join('{}\n'.format(top.substructures[i]) for i in range(top.num_subst))
+        tail += '\n'
+        self.template = _escape(header) + atoms + _escape(tail)
+
+    def write_frame(self, coords=None):
+        # Writes the current coordinates of the molecule, or the given
+        # (natoms, 3) coordinates, as a new mol2 record
+        if coords is None:
+            coords = batched_potential_energy.get_coordinates(self.molecule)
+        self.outf.write(self.template.format(*np.asarray(coords, dtype=np.float64).ravel().tolist()))
+        self.num_frames += 1
+
+    def close(self):
+        self.outf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class NpyArrayWriter:
+    # Appends frames of a fixed shape to a (K,) + frame_shape .npy array. The
+    # header is written with a fixed size, so that it can be rewritten in
+    # place with the number of frames whenever the file is flushed. With
+    # append=True an existing file written by this class is continued.
+    HEADER_SIZE = 128
+
+    def __init__(self, filename, frame_shape, dtype='float32', append=False):
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.num_frames = 0
+        if append:
+            self.outf = open(filename, 'rb+')
+            np.lib.format.read_magic(self.outf)
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(self.outf)
+            if (self.outf.tell() != self.HEADER_SIZE or fortran_order or dtype != self.dtype
+                    or tuple(shape[1:]) != self.frame_shape):
+                raise ValueError('Cannot append to {}'.format(filename))
+            self.num_frames = shape[0]
+            self.outf.seek(self.HEADER_SIZE + self.num_frames * self.frame_size())
+            self.outf.truncate()
+        else:
+            self.outf = open(filename, 'wb+')
+            self._write_header()
+
+    def frame_size(self):
+        return int(np.prod(self.frame_shape)) * self.dtype.itemsize
+
+    def _write_header(self):
+        shape = (self.num_frames,) + self.frame_shape
+        text = "{{'descr': '{}', 'fortran_order': False, 'shape': {}, }}".format(
+            self.dtype.str, shape)
+        text = text.ljust(self.HEADER_SIZE - 11) + '\n'
+        position = self.outf.tell()
+        self.outf.seek(0)
+        self.outf.write(b'\x93NUMPY\x01\x00')
+        self.outf.write(np.uint16(len(text)).astype('<u2').tobytes())
+        self.outf.write(text.encode('latin1'))
+        self.outf.seek(max(position, self.HEADER_SIZE))
+
+    def write_frame(self, frames):
+        # Appends one frame or a (K,) + frame_shape stack of frames
+        frames = np.ascontiguousarray(frames, dtype=self.dtype).reshape((-1,) + self.frame_shape)
+        self.outf.write(frames.tobytes())
+        self.num_frames += len(frames)
+
+    def flush(self):
+        self._write_header()
+        self.outf.flush()
+
+    def close(self):
+        self.flush()
+        self.outf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class NpyTrajectoryWriter(NpyArrayWriter):
+    # (K, natoms, 3) stack of coordinate frames
+    def __init__(self, filename, num_atoms, dtype='float32', append=False):
+        NpyArrayWriter.__init__(self, filename, (num_atoms, 3), dtype, append)
+        self.num_atoms = num_atoms
@@ -0,0 +1,148 @@
+import time
+
+import numpy as np
+
+import BatchedPotential.batched_potential_energy as batched_potential_energy
+import BatchedForce.batched_force as batched_force
+
+# Energy minimization of the bond + angle + dihedral potential. Both methods
+# share a backtracking (Armijo) line search and stop when the RMS gradient or
+# the energy change between iterations falls below its tolerance, or after
+# max_iterations steps. The final coordinates are written back to the molecule.
+
+class MinimizationResult:
+    def __init__(self):
+        self.method      = ''
+        self.energy      = 0.0   # final energy
+        self.rms_gradient = 0.0  # final RMS gradient (kcal/mol/A)
+        self.iterations  = 0     # number of iterations performed
+        self.evaluations = 0     # number of energy + force evaluations
+        self.converged   = False
+        self.energies    = []    # energy after each iteration
+        self.timings     = []    # wall time of each iteration (seconds)
+
+def _rms(forces):
+    return float(np.sqrt(np.mean(forces * forces)))
+
+def _limit_step(direction, max_step):
+    # Scales the direction so that no atom moves more than max_step Angstroms
+    largest = np.sqrt((direction * direction).sum(axis=-1)).max()
+    if largest > max_step:
+        return direction * (max_step / largest)
+    return direction
+
+def line_search(molecule, coords, energy, forces, direction, step, result,
+                c1=1e-4, shrink=0.5, min_step=1e-10):
+    # Backtracking line search along direction, starting from step, until the
+    # Armijo condition E(x + step*d) <= E(x) + c1*step*(grad . d) holds.
+    slope = -float((forces * direction).sum())
+    while step > min_step:
+        new_coords = coords + step * direction
+        new_energy, new_forces = batched_force.energy_and_forces(molecule, new_coords)
+        result.evaluations += 1
+        if new_energy <= energy + c1 * step * slope:
+            return step, new_coords, float(new_energy), new_forces
+        step *= shrink
+    return 0.0, coords, energy, forces
+
+def _set_coordinates(molecule, coords):
+    molecule.coords[:] = coords
+
+def _converged(result, energy, previous, forces, rms_tolerance, energy_tolerance):
+    result.rms_gradient = _rms(forces)
+    return result.rms_gradient < rms_tolerance or abs(previous - energy) < energy_tolerance
+
+def _report(result, iteration_time, verbose):
+    result.iterations += 1
+    result.energies.append(result.energy)
+    result.timings.append(iteration_time)
+    if verbose:
+        print('{:6d} {:16.6f} {:12.6f} {:10.6f}s'.format(
+            result.iterations, result.energy, result.rms_gradient, iteration_time))
+
+def steepest_descent(molecule, max_iterations=1000, rms_tolerance=1e-3, energy_tolerance=1e-8,
+                     step=0.1, max_step=0.2, verbose=False):
+    result = MinimizationResult()
+    result.method = 'steepest descent'
+    coords = batched_potential_energy.get_coordinates(molecule)
+    energy, forces = batched_force.energy_and_forces(molecule, coords)
+    result.energy, result.evaluations = float(energy), 1
+    result.rms_gradient = _rms(forces)
+    result.converged = result.rms_gradient < rms_tolerance
+    while not result.converged and result.iterations < max_iterations:
+        start = time.perf_counter()
+        previous = result.energy
+        direction = _limit_step(forces, max_step / step)
+        accepted, coords, result.energy, forces = line_search(
+            molecule, coords, result.energy, forces, direction, step, result)
+        if accepted == 0:
+            # no downhill step along the force: a (numerical) minimum
+            result.converged = True
+        else:
+            # accepted steps grow the trial step of the next iteration
+            step = min(accepted * 1.5, 1.0)
+            result.converged = _converged(result, result.energy, previous, forces,
+                                          rms_tolerance, energy_tolerance)
+        _report(result, time.perf_counter() - start, verbose)
+    _set_coordinates(molecule, coords)
+    return result
+
+def lbfgs(molecule, max_iterations=1000, rms_tolerance=1e-3, energy_tolerance=1e-8,
+          memory=10, max_step=0.2, verbose=False):
+    result = MinimizationResult()
+    result.method = 'L-BFGS'
+    coords = batched_potential_energy.get_coordinates(molecule)
+    energy, forces = batched_force.energy_and_forces(molecule, coords)
+    result.energy, result.evaluations = float(energy), 1
+    result.rms_gradient = _rms(forces)
+    result.converged = result.rms_gradient < rms_tolerance
+    s_list, y_list, rho_list = [], [], []
+    while not result.converged and result.iterations < max_iterations:
+        start = time.perf_counter()
+        previous = result.energy
+        # two-loop recursion: direction = -H * gradient = H * forces
+        q = forces.ravel().copy()
+        alphas = []
+        for s, y, rho in zip(reversed(s_list), reversed(y_list), reversed(rho_list)):
+            alpha = rho * s.dot(q)
+            q -= alpha * y
+            alphas.append(alpha)
+        if s_list:
+            q *= s_list[-1].dot(y_list[-1]) / y_list[-1].dot(y_list[-1])
+        for s, y, rho, alpha in zip(s_list, y_list, rho_list, reversed(alphas)):
+            beta = rho * y.dot(q)
+            q += (alpha - beta) * s
+        direction = q.reshape(forces.shape)
+        if (direction * forces).sum() <= 0:
+            # not a descent direction: restart from the force
+            s_list, y_list, rho_list = [], [], []
+            direction = forces
+        direction = _limit_step(direction, max_step)
+        accepted, new_coords, result.energy, new_forces = line_search(
+            molecule, coords, result.energy, forces, direction, 1.0, result)
+        if accepted == 0:
+            if not s_list:
+                result.converged = True
+            s_list, y_list, rho_list = [], [], []
+        else:
+            s = (new_coords - coords).ravel()
+            y = (forces - new_forces).ravel()  # change of the gradient
+            if s.dot(y) > 1e-12:
+                s_list.append(s)
+                y_list.append(y)
+                rho_list.append(1 / s.dot(y))
+                if len(s_list) > memory:
+                    del s_list[0], y_list[0], rho_list[0]
+            coords, forces = new_coords, new_forces
+            result.converged = _converged(result, result.energy, previous, forces,
+                                          rms_tolerance, energy_tolerance)
+        _report(result, time.perf_counter() - start, verbose)
+    _set_coordinates(molecule, coords)
+    return result
+
+def minimize(molecule, method='lbfgs', **kwargs):
+    if method == 'lbfgs':
+        return lbfgs(molecule, **kwargs)
+    elif method == 'steepest':
+        return steepest_descent(molecule, **kwargs)
+    raise ValueError('Unknown minimization method: {}'.format(method))
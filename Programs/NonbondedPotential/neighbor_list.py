@@ -0,0 +1,76 @@
+import numpy as np
+
+import BatchedPotential.batched_potential_energy as batched_potential_energy
+
+# Verlet neighbor list built with a cell list. Atoms are binned into cubic
+# cells of side cutoff + skin, and only pairs in the same or adjacent cells
+# are tested, so a build costs O(N) instead of O(N^2). The list holds every
+# pair closer than cutoff + skin, and stays valid until some atom has moved
+# more than skin / 2 since the build.
+
+# the 13 "forward" neighbor cells; with the cell itself they cover every
+# adjacent pair of cells once
+_OFFSETS = np.array([(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+                     if (dx, dy, dz) > (0, 0, 0)], dtype=np.intp)
+
+def cell_list_pairs(coords, radius):
+    # (M, 2) pairs i < j of the (natoms, 3) coordinates closer than radius
+    natoms = len(coords)
+    if natoms < 2:
+        return np.zeros((0, 2), dtype=np.intp)
+    cells = np.floor((coords - coords.min(axis=0)) / radius).astype(np.intp) + 1
+    # one empty layer of cells on every side, so that offsets never wrap
+    # around into an occupied cell
+    dims = cells.max(axis=0) + 2
+    key = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    order = np.argsort(key, kind='stable')
+    key = key[order]
+    position = np.arange(natoms)
+    # pairs within a cell: each atom with the atoms after it in the cell
+    end = np.searchsorted(key, key, side='right')
+    counts = end - position - 1
+    first = [np.repeat(position, counts)]
+    second = [first[0] + 1 + batched_potential_energy.ranges(counts)]
+    for dx, dy, dz in _OFFSETS:
+        target = key + (dx * dims[1] + dy) * dims[2] + dz
+        start = np.searchsorted(key, target, side='left')
+        counts = np.searchsorted(key, target, side='right') - start
+        first.append(np.repeat(position, counts))
+        second.append(np.repeat(start, counts) + batched_potential_energy.ranges(counts))
+    i = order[np.concatenate(first)]
+    j = order[np.concatenate(second)]
+    d = coords[i] - coords[j]
+    close = np.einsum('ij,ij->i', d, d) < radius * radius
+    pairs = np.stack((i[close], j[close]), axis=1)
+    pairs.sort(axis=1)
+    return pairs
+
+class NeighborList:
+    def __init__(self, cutoff=10.0, skin=2.0, excluded=None):
+        self.cutoff    = cutoff
+        self.skin      = skin
+        self.excluded  = excluded # sorted i*natoms+j keys of pairs left out of the list
+        self.pairs     = None     # (M, 2) pairs i < j closer than cutoff + skin
+        self.reference = None     # coordinates of the last build
+        self.num_builds = 0
+
+    def needs_update(self, coords):
+        if self.reference is None or self.reference.shape != coords.shape:
+            return True
+        d = coords - self.reference
+        return np.einsum('ij,ij->i', d, d).max() > 0.25 * self.skin * self.skin
+
+    def build(self, coords):
+        pairs = cell_list_pairs(coords, self.cutoff + self.skin)
+        if self.excluded is not None and len(self.excluded):
+            keys = pairs[:, 0] * len(coords) + pairs[:, 1]
+            pairs = pairs[~np.isin(keys, self.excluded, assume_unique=True)]
+        self.pairs = pairs
+        self.reference = np.array(coords, dtype=np.float64)
+        self.num_builds += 1
+
+    def update(self, coords):
+        # The pairs for coords, rebuilding the list only if needed
+        if self.needs_update(coords):
+            self.build(coords)
+        return self.pairs
@@ -0,0 +1,123 @@
+import numpy as np
+
+import BatchedPotential.batched_potential_energy as batched_potential_energy
+import BatchedForce.batched_force as batched_force
+from NonbondedPotential.neighbor_list import NeighborList
+
+# Lennard-Jones and Coulomb terms between atoms more than two bonds apart,
+# with the AMBER combination and scaling rules: Rmin = R*i + R*j,
+# epsilon = sqrt(epsilon_i * epsilon_j), and the 1-4 pairs divided by SCNB
+# (van der Waals) and SCEE (electrostatics). The 1-2 and 1-3 pairs are
+# excluded, and the 1-4 pairs are kept in a list of their own, computed
+# without cutoff. All the other pairs come from a neighbor list and are
+# truncated at its cutoff.
+
+COULOMB = 332.0636  # kcal/mol * Angstrom / e^2
+SCNB = 2.0
+SCEE = 1.2
+
+def get_exclusions(molecule):
+    # Sorted i*natoms+j keys (i < j) of the 1-2 and 1-3 pairs, and the (P, 2)
+    # 1-4 pairs that are neither, from the bond graph
+    natoms = molecule.num_atoms
+    graph = molecule.get_bond_graph()
+    bonds = batched_potential_energy.get_index_array(molecule.topology.bond_list, 2)
+    angles = graph.get_angles()
+    dihedrals = graph.get_dihedrals(bonds)
+    close = np.sort(np.concatenate((bonds, angles[:, [0, 2]])), axis=1)
+    excluded = np.unique(close[:, 0] * natoms + close[:, 1])
+    ends = np.sort(dihedrals[:, [0, 3]], axis=1)
+    keys = np.unique(ends[:, 0] * natoms + ends[:, 1])
+    keys = keys[~np.isin(keys, excluded, assume_unique=True)]
+    return excluded, np.stack((keys // natoms, keys % natoms), axis=1)
+
+def nonbonded_parameters(molecule):
+    # R*, epsilon and charge of every atom
+    types = molecule.topology.nonbonded_types
+    Rmin = np.zeros(molecule.num_atoms, dtype=molecule.accum_dtype)
+    epsilon = np.zeros(molecule.num_atoms, dtype=molecule.accum_dtype)
+    atom_type = np.asarray(molecule.atom_type)
+    for t in np.unique(atom_type):
+        if t not in types:
+            raise AttributeError('Could not find corresponding nonbonded type')
+        Rmin[atom_type == t], epsilon[atom_type == t] = types[t]
+    charge = np.zeros(molecule.num_atoms, dtype=molecule.accum_dtype)
+    if len(molecule.topology.charge):
+        charge = np.asarray(molecule.topology.charge, dtype=molecule.accum_dtype)
+    return Rmin, epsilon, charge
+
+def _list_exclusions(top, natoms):
+    # pairs kept out of the neighbor list: 1-2, 1-3 and the 1-4 pairs, 
+    # which have their own list
+    keys14 = top.pairs14[:, 0] * natoms + top.pairs14[:, 1]
+    return np.union1d(top.excluded_pairs, keys14)
+
+def assign_nonbonded(molecule, cutoff=10.0, skin=2.0):
+    # Fills the nonbonded tables of the topology and attaches a neighbor list,
+    # which turns the nonbonded terms on in batched_force.energy_and_forces
+    top = molecule.topology
+    top.nonbonded_Rmin, top.nonbonded_epsilon, top.nonbonded_charge = nonbonded_parameters(molecule)
+    top.excluded_pairs, top.pairs14 = get_exclusions(molecule)
+    top.neighbor_list = NeighborList(cutoff, skin, _list_exclusions(top, molecule.num_atoms))
+    return top
+
+def pair_energy_forces(coords, pairs, Rmin, epsilon, charge, forces, cutoff=None,
+                       vdw_scale=1.0, elec_scale=1.0):
+    # Van der Waals and electrostatic energies of the pairs, with their forces
+    # added to forces (if not None). Pairs beyond cutoff are left out.
+    i, j = pairs[:, 0], pairs[:, 1]
+    d = coords[..., i, :] - coords[..., j, :]
+    r2 = batched_force.dot(d, d)
+    inside = r2 > 0
+    if cutoff is not None:
+        inside &= r2 < cutoff * cutoff
+    inv_r2 = batched_force.safe_divide(inside.astype(np.float64), r2)
+    inv_r = np.sqrt(inv_r2)
+    R = Rmin[i] + Rmin[j]
+    eps = np.sqrt(epsilon[i] * epsilon[j]) / vdw_scale
+    qq = COULOMB * charge[i] * charge[j] / elec_scale
+    s6 = (R * R * inv_r2) ** 3
+    vdw = eps * (s6 * s6 - 2 * s6)
+    elec = qq * inv_r
+    if forces is not None:
+        # -dV/dr / r, along d = ri - rj
+        f = (12 * eps * (s6 * s6 - s6) + elec) * inv_r2
+        fd = f[..., None] * d
+        batched_force.scatter_forces(forces, pairs, np.stack((fd, -fd), axis=-2))
+    return vdw.sum(axis=-1), elec.sum(axis=-1)
+
+def _list_energy_forces(top, coords, pairs, forces, cutoff):
+    # neighbor-list pairs truncated at cutoff, plus the scaled 1-4 pairs
+    vdw, elec = pair_energy_forces(coords, pairs, top.nonbonded_Rmin, top.nonbonded_epsilon,
+                                   top.nonbonded_charge, forces, cutoff)
+    vdw14, elec14 = pair_energy_forces(coords, top.pairs14, top.nonbonded_Rmin,
+                                       top.nonbonded_epsilon, top.nonbonded_charge, forces,
+                                       None, SCNB, SCEE)
+    return vdw + vdw14, elec + elec14
+
+def nonbonded_energy_forces(molecule, coords, forces=None):
+    # (vdw, elec) energies of the (natoms, 3) coordinates, with the forces 
+    # added to forces. The neighbor list of the topology is rebuilt only when 
+    # needed. A (K, natoms, 3) stack is evaluated frame by frame, each with
+    # pairs of its own.
+    top = molecule.topology
+    if top.neighbor_list is None:
+        assign_nonbonded(molecule)
+    cutoff = top.neighbor_list.cutoff
+    if coords.ndim == 2:
+        pairs = top.neighbor_list.update(coords)
+        return _list_energy_forces(top, coords, pairs, forces, cutoff)
+    vdw = np.zeros(coords.shape[:-2])
+    elec = np.zeros(coords.shape[:-2])
+    frame_list = NeighborList(cutoff, 0.0, top.neighbor_list.excluded)
+    for k in np.ndindex(*coords.shape[:-2]):
+        frame_list.build(coords[k])
+        vdw[k], elec[k] = _list_energy_forces(top, coords[k], frame_list.pairs,
+                                              None if forces is None else forces[k], cutoff)
+    return vdw, elec
+
+def nonbonded_potential(molecule):
+    # (van der Waals, electrostatic) energy of the molecule
+    coords = batched_potential_energy.get_coordinates(molecule)
+    vdw, elec = nonbonded_energy_forces(molecule, coords)
+    return float(vdw), float(elec)
@@ -0,0 +1,214 @@
+import argparse
+import csv
+import glob
+import hashlib
+import math
+import multiprocessing
+import os
+import signal
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from Classes.Molecule import Molecule
+import Classes.ForceField as ForceField
+import BatchedPotential.batched_potential_energy as batched_potential_energy
+import DihedralPotential.dihedral_energy_profile as dihedral_energy_profile
+import Minimization.minimize as minimize
+import conformer_search
+import profiling
+import IO.snapshot as molecule_snapshot
+
+# Runs one task (energy, scan, minimize or search) over a library of
+# mol2 + frcmod pairs, spread over a pool of processes. Every job has its own
+# timeout, and errors are reported in the status column instead of stopping
+# the run. Results are written, in the order of the input, to one CSV (or TSV)
+# file. The result column depends on the task: the highest torsion barrier
+# over the rotatable bonds (scan), the minimized energy (minimize) or the
+# lowest dihedral energy of the conformers (search). With --snapshots, every
+# prepared molecule is saved as a binary snapshot (IO.snapshot) and later runs
+# map it back instead of parsing the mol2 and frcmod files again; snapshots
+# are keyed on the absolute paths of both files, which are also stored in
+# the snapshot and checked before it is reused. With --profile, the call
+# counts and times of every job (see profiling) are written to one JSON file
+# per job, named like its snapshot.
+
+TASKS = ('energy', 'scan', 'minimize', 'search')
+FIELDS = ['name', 'task', 'status', 'num_atoms', 'bond', 'angle', 'dihedral', 'total',
+          'result', 'seconds']
+
+def get_cmd_line():
+    parser = argparse.ArgumentParser(description='Batch energy, scan, minimization and conformer search.')
+    parser.add_argument('--manifest',  action='store', dest='manifest',  help='File with one "mol2 frcmod" pair per line.')
+    parser.add_argument('--dir',       action='store', dest='dir',       help='Directory of name.mol2 + name.frcmod pairs.')
+    parser.add_argument('--task',      action='store', dest='task',      default='energy', choices=TASKS)
+    parser.add_argument('--out',       action='store', dest='out',       required=True, help='Output .csv or .tsv file.')
+    parser.add_argument('--workers',   action='store', dest='workers',   type=int, default=os.cpu_count())
+    parser.add_argument('--chunksize', action='store', dest='chunksize', type=int, default=16)
+    parser.add_argument('--timeout',   action='store', dest='timeout',   type=float, default=0, help='Seconds per job (0: none).')
+    parser.add_argument('--precision', action='store', dest='precision', default='mixed', choices=('mixed', 'double'))
+    parser.add_argument('--theta',     action='store', dest='theta',     type=float, default=30, help='Scan/search step (degrees).')
+    parser.add_argument('--snapshots', action='store', dest='snapshots', help='Directory of prepared molecule snapshots.')
+    parser.add_argument('--profile',   action='store', dest='profile',   help='Directory for the profile of every job.')
+    arguments = parser.parse_args()
+    if (arguments.manifest is None) == (arguments.dir is None):
+        parser.error('give exactly one of --manifest and --dir')
+    return arguments
+
+def read_manifest(filename):
+    # (name, mol2, frcmod) jobs from lines "mol2 frcmod" (spaces, tabs or a
+    # comma); relative paths are taken from the directory of the manifest.
+    # The name of a job is its mol2 path as written, without the extension.
+    base = os.path.dirname(os.path.abspath(filename))
+    jobs = []
+    names = set()
+    with open(filename) as inf:
+        for line in inf:
+            line = line.split('#')[0].replace(',', ' ').split()
+            if not line:
+                continue
+            if len(line) != 2:
+                raise ValueError('Manifest lines must have a mol2 and a frcmod file: {}'.format(' '.join(line)))
+            mol2, frcmod = [os.path.join(base, name) for name in line]
+            name = os.path.splitext(os.path.normpath(line[0]))[0]
+            if name in names:
+                raise ValueError('Duplicate manifest entry: {}'.format(line[0]))
+            names.add(name)
+            jobs.append((name, mol2, frcmod))
+    return jobs
+
+def read_directory(path):
+    # (name, mol2, frcmod) jobs for every name.mol2 with a name.frcmod beside it
+    jobs = []
+    for mol2 in sorted(glob.glob(os.path.join(path, '*.mol2'))):
+        frcmod = os.path.splitext(mol2)[0] + '.frcmod'
+        if os.path.exists(frcmod):
+            jobs.append((os.path.splitext(os.path.basename(mol2))[0], mol2, frcmod))
+    return jobs
+
+def job_key(name, mol2, frcmod):
+    # File name (without extension) of the snapshot and profile of a job:
+    # the last part of its name and a hash of the absolute paths of its
+    # input files, so that jobs with the same name never share files
+    paths = '\n'.join(os.path.abspath(path) for path in (mol2, frcmod))
+    digest = hashlib.sha256(paths.encode()).hexdigest()[:16]
+    return '{}-{}'.format(os.path.basename(name), digest)
+
+def load_molecule(mol2, frcmod, precision='mixed', snapshot=None):
+    # A snapshot of the same input files, newer than both, is loaded instead
+    # of them; any other one is (re)written after preparing the molecule
+    molecule = Molecule(precision)
+    source = [os.path.abspath(mol2), os.path.abspath(frcmod)]
+    if snapshot is not None and os.path.exists(snapshot):
+        mtime = os.path.getmtime(snapshot)
+        if (mtime >= os.path.getmtime(mol2) and mtime >= os.path.getmtime(frcmod) and
+                molecule_snapshot.read_header(snapshot).get('source') == source):
+            molecule.load_snapshot(snapshot)
+            return molecule
+    molecule.read_mol2(mol2)
+    molecule.gen_dihed_list_from_angle_list()
+    molecule.read_frcmod(frcmod)
+    if snapshot is not None:
+        molecule.save_snapshot(snapshot, source)
+    return molecule
+
+def _timeout(signum, frame):
+    raise TimeoutError('timed out')
+
+def run_task(molecule, task, theta):
+    # Task-specific result of one molecule
+    if task == 'scan':
+        grid = theta * np.arange(int(round(2 * math.pi / theta)))
+        barrier = 0.0
+        for b, c in conformer_search.get_rotatable_bonds(molecule).tolist():
+            profile = dihedral_energy_profile.torsion_profile(
+                dihedral_energy_profile.get_torsion_terms(molecule, b, c), grid)
+            barrier = max(barrier, float(profile.max() - profile.min()))
+        return barrier
+    elif task == 'minimize':
+        return minimize.minimize(molecule).energy
+    elif task == 'search':
+        return float(conformer_search.conformer_search(molecule, theta, 1).energies[0])
+    return ''
+
+def run_job(job):
+    # Worker: one row of the output. Runs in the main thread of a pool
+    # process, where a SIGALRM timer can interrupt it.
+    name, mol2, frcmod, task, theta, timeout, precision, snapshot, profile = job
+    row = dict.fromkeys(FIELDS, '')
+    row['name'], row['task'] = name, task
+    start = time.perf_counter()
+    if timeout > 0:
+        signal.signal(signal.SIGALRM, _timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    if profile is not None:
+        profiling.reset()
+        profiling.enable()
+    try:
+        molecule = load_molecule(mol2, frcmod, precision, snapshot)
+        row['num_atoms'] = molecule.num_atoms
+        row['bond'] = batched_potential_energy.bond_potential(molecule)
+        row['angle'] = batched_potential_energy.angle_potential(molecule)
+        row['dihedral'] = batched_potential_energy.dihedral_potential(molecule)
+        row['total'] = row['bond'] + row['angle'] + row['dihedral']
+        row['result'] = run_task(molecule, task, theta)
+        row['status'] = 'ok'
+    except Exception as error:
+        row['status'] = '{}: {}'.format(type(error).__name__, error)
+    finally:
+        if timeout > 0:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        if profile is not None:
+            profiling.disable()
+            profiling.dump(profile, name=name, task=task, status=row['status'], num_atoms=row['num_atoms'])
+    row['seconds'] = '{:.4f}'.format(time.perf_counter() - start)
+    return row
+
+def run_batch(jobs, out, task='energy', theta=math.pi/6, workers=None, chunksize=16, timeout=0,
+              precision='mixed', snapshots=None, profile=None):
+    # Writes one row per (name, mol2, frcmod) job to out and returns the
+    # number of jobs that failed
+    delimiter = '\t' if out.endswith('.tsv') else ','
+    for directory in (snapshots, profile):
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+    tasks = [(name, mol2, frcmod, task, theta, timeout, precision,
+              None if snapshots is None else os.path.join(
+                  snapshots, '{}.{}.snap'.format(job_key(name, mol2, frcmod), precision)),
+              None if profile is None else os.path.join(
+                  profile, '{}.json'.format(job_key(name, mol2, frcmod))))
+             for name, mol2, frcmod in jobs]
+    # force fields shared by several molecules are parsed once here, and the
+    # workers forked below inherit them
+    counts = Counter(os.path.abspath(frcmod) for name, mol2, frcmod in jobs)
+    for frcmod, count in counts.items():
+        if count > 1 and os.path.exists(frcmod):
+            ForceField.load_forcefield(frcmod)
+    failed = 0
+    with open(out, 'w', newline='') as outf:
+        writer = csv.DictWriter(outf, FIELDS, delimiter=delimiter)
+        writer.writeheader()
+        # fork, where available, so that the workers share the preloaded force fields
+        context = None
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            for row in executor.map(run_job, tasks, chunksize=max(1, chunksize)):
+                failed += row['status'] != 'ok'
+                writer.writerow(row)
+    return failed
+
+def main():
+    arguments = get_cmd_line()
+    if arguments.manifest is not None:
+        jobs = read_manifest(arguments.manifest)
+    else:
+        jobs = read_directory(arguments.dir)
+    failed = run_batch(jobs, arguments.out, arguments.task, arguments.theta * math.pi / 180,
+                       arguments.workers, arguments.chunksize, arguments.timeout, arguments.precision,
+                       arguments.snapshots, arguments.profile)
+    print('{} jobs, {} failed'.format(len(jobs), failed))
+
+if __name__ == '__main__': main()
@@ -0,0 +1,192 @@
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from Classes.Molecule import Molecule
+import BondPotential.bond_potential_energy as bond_potential_energy
+import AnglePotential.angle_potential_energy as angle_potential_energy
+import DihedralPotential.dihedral_potential_energy as dihedral_potential_energy
+import BondForce.bond_force as bond_force
+import AngleForce.angle_force as angle_force
+import DihedralForce.dihedral_force as dihedral_force
+import conformer_search
+import heuristic_conformation
+import rotate
+import synthetic_molecule
+
+# Timings of the hot paths (energies, forces, rotation, the heuristic and the
+# readers/writers) on the bundled molecules and on synthetic molecules of
+# growing size (see synthetic_molecule). Every benchmark is run repeat times and its best
+# and mean wall times are written as JSON, so that two runs (e.g. before and
+# after a change) can be compared with --compare.
+
+VERSION = 1
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Input files of the bundled molecules, relative to the repository root
+MOLECULES = {
+    'butane':          {'mol2': 'butane/sqm/sqm.mol2', 'psf': 'butane/butane.psf',
+                        'pdb': 'butane/butane.pdb', 'frcmod': 'butane/butane_parm.frcmod'},
+    'water':           {'psf': 'water/water.psf', 'pdb': 'water/water.pdb',
+                        'frcmod': 'water/water.frcmod'},
+    '3-metil-pentano': {'mol2': '3-metil-pentano/3-metil-pentano.mol2',
+                        'psf': '3-metil-pentano/3-metil-pentano.psf',
+                        'pdb': '3-metil-pentano/3-metil-pentano.pdb',
+                        'frcmod': '3-metil-pentano/3-metil-pentano.frcmod'},
+    'Etileno_glicol':  {'mol2': 'Etileno_glicol/ligand.mol2', 'pdb': 'Etileno_glicol/sqm.pdb',
+                        'frcmod': 'Etileno_glicol/ligand.frcmod'},
+    '1b5e_1':          {'mol2': 'sample_files/1b5e_1.mol2'},
+}
+SYNTHETIC_KINDS = ('alkane',)
+SYNTHETIC_SIZES = (10, 100, 1000)  # number of carbons
+BENCHMARKS = ('read_mol2', 'read_psf', 'read_pdb', 'write_mol2', 'bond_potential',
+              'angle_potential', 'total_dihedral_potential', 'bond_force', 'angle_force',
+              'dihedral_force', 'rotate', 'heuristic_conformation')
+
+def get_cmd_line():
+    parser = argparse.ArgumentParser(description='Benchmarks of the energy, force, rotation and I/O routines.')
+    parser.add_argument('--out',        action='store', dest='out',        help='JSON output file (default: standard output).')
+    parser.add_argument('--repeat',     action='store', dest='repeat',     type=int, default=5)
+    parser.add_argument('--sizes',      action='store', dest='sizes',      type=int, nargs='*', default=list(SYNTHETIC_SIZES), help='Carbons of the synthetic molecules.')
+    parser.add_argument('--kinds',      action='store', dest='kinds',      nargs='*', default=list(SYNTHETIC_KINDS), choices=synthetic_molecule.KINDS, help='Kinds of synthetic molecules.')
+    parser.add_argument('--molecules',  action='store', dest='molecules',  nargs='*', default=list(MOLECULES), help='Bundled molecules to run.')
+    parser.add_argument('--benchmarks', action='store', dest='benchmarks', nargs='*', default=list(BENCHMARKS), choices=BENCHMARKS)
+    parser.add_argument('--precision',  action='store', dest='precision',  default='mixed', choices=('mixed', 'double'))
+    parser.add_argument('--compare',    action='store', dest='compare',    help='Earlier JSON output to compare against.')
+    return parser.parse_args()
+
+def load_bundled(files, precision='mixed'):
+    # The molecule from its mol2 file or, failing that, from its psf and pdb
+    molecule = Molecule(precision)
+    if 'mol2' in files:
+        molecule.read_mol2(files['mol2'])
+        molecule.gen_dihed_list_from_angle_list()
+    else:
+        molecule.read_psf(files['psf'])
+        molecule.read_pdb(files['pdb'])
+    if 'frcmod' in files:
+        molecule.read_frcmod(files['frcmod'])
+    return molecule
+
+def time_call(function, repeat, setup=None):
+    # Best and mean wall time of function() over repeat calls; setup() runs
+    # before every call and is not timed
+    times = []
+    for k in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times), sum(times) / len(times)
+
+def get_benchmarks(molecule, files, directory):
+    # {name: (function, setup)} of the benchmarks that apply to the molecule
+    benchmarks = {}
+    if 'mol2' in files:
+        benchmarks['read_mol2'] = (lambda: Molecule(molecule.precision).read_mol2(files['mol2']), None)
+    if 'psf' in files:
+        benchmarks['read_psf'] = (lambda: Molecule(molecule.precision).read_psf(files['psf']), None)
+    if 'pdb' in files:
+        benchmarks['read_pdb'] = (lambda: Molecule(molecule.precision).read_pdb(files['pdb']), None)
+    if len(molecule.topology.subst_id):  # mol2 fields read
+        out = os.path.join(directory, 'out.mol2')
+        benchmarks['write_mol2'] = (lambda: molecule.write_mol2(out, 'w'), None)
+    if not (molecule.topology.bond_types or molecule.topology.angle_types):
+        return benchmarks  # no force field: I/O only
+
+    def forces(routine):
+        fx, fy, fz = [np.zeros(molecule.num_atoms) for i in range(3)]
+        return lambda: routine(molecule, fx, fy, fz)
+    benchmarks['bond_potential'] = (lambda: bond_potential_energy.bond_potential(molecule), None)
+    benchmarks['angle_potential'] = (lambda: angle_potential_energy.angle_potential(molecule), None)
+    benchmarks['total_dihedral_potential'] = (
+        lambda: dihedral_potential_energy.total_dihedral_potential(molecule), None)
+    benchmarks['bond_force'] = (forces(bond_force.bond_force), None)
+    benchmarks['angle_force'] = (forces(angle_force.angle_force), None)
+    benchmarks['dihedral_force'] = (forces(dihedral_force.dihedral_force), None)
+    # rotations and the heuristic start from the original coordinates every time
+    reference = molecule.snapshot()
+    restore = lambda: molecule.restore(reference)
+    bonds = conformer_search.get_rotatable_bonds(molecule)
+    if len(bonds):
+        b, c = (int(i) + 1 for i in bonds[len(bonds) // 2])
+        rlist = rotate.get_rotation_list(molecule, b, c)
+        benchmarks['rotate'] = (lambda: rotate.rotate(molecule, rlist, b, c, math.pi / 18, 36), restore)
+    benchmarks['heuristic_conformation'] = (
+        lambda: heuristic_conformation.heuristic_conformation(molecule, math.pi / 6), restore)
+    return benchmarks
+
+def run_benchmarks(molecules=MOLECULES, sizes=SYNTHETIC_SIZES, names=BENCHMARKS, repeat=5,
+                   precision='mixed', log=None, kinds=SYNTHETIC_KINDS):
+    # List of {molecule, num_atoms, benchmark, repeat, best, mean} results
+    results = []
+    directory = tempfile.mkdtemp()
+    try:
+        cases = []
+        for name in molecules:
+            files = {kind: os.path.join(ROOT, path) for kind, path in MOLECULES[name].items()}
+            cases.append((name, load_bundled(files, precision), files))
+        for kind in kinds:
+            for ncarbons in sizes:
+                name = '{}-{}'.format(kind, ncarbons)
+                molecule = synthetic_molecule.build_molecule(kind, ncarbons, precision=precision)
+                files = synthetic_molecule.write_files(molecule, os.path.join(directory, name))
+                cases.append((name, molecule, files))
+        for name, molecule, files in cases:
+            benchmarks = get_benchmarks(molecule, files, directory)
+            for benchmark in names:
+                if benchmark not in benchmarks:
+                    continue
+                function, setup = benchmarks[benchmark]
+                best, mean = time_call(function, repeat, setup)
+                results.append({'molecule': name, 'num_atoms': molecule.num_atoms,
+                                'benchmark': benchmark, 'repeat': repeat, 'best': best, 'mean': mean})
+                if log is not None:
+                    log.write('{:20s} {:7d} {:26s} {:12.6f} s\n'.format(name, molecule.num_atoms, benchmark, best))
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+def compare(old, new, out=sys.stdout):
+    # Ratio of the best times (old / new, > 1 is faster) of the benchmarks in both runs
+    previous = {(r['molecule'], r['benchmark']): r['best'] for r in old['results']}
+    out.write('{:20s} {:26s} {:>12s} {:>12s} {:>8s}\n'.format('molecule', 'benchmark', 'old (s)', 'new (s)', 'speedup'))
+    for r in new['results']:
+        key = (r['molecule'], r['benchmark'])
+        if key in previous:
+            out.write('{:20s} {:26s} {:12.6f} {:12.6f} {:8.2f}\n'.format(
+                r['molecule'], r['benchmark'], previous[key], r['best'], previous[key] / max(r['best'], 1e-12)))
+
+def main():
+    arguments = get_cmd_line()
+    results = run_benchmarks(arguments.molecules, arguments.sizes, arguments.benchmarks,
+                             arguments.repeat, arguments.precision, sys.stderr, arguments.kinds)
+    report = {
+        'version': VERSION,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'precision': arguments.precision,
+        'results': results,
+    }
+    if arguments.out is None:
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write('\n')
+    else:
+        with open(arguments.out, 'w') as outf:
+            json.dump(report, outf, indent=1)
+    if arguments.compare is not None:
+        with open(arguments.compare) as inf:
+            compare(json.load(inf), report, sys.stderr)
+
+if __name__ == '__main__': main()
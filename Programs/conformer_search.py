@@ -0,0 +1,126 @@
+import math
+import heapq
+
+import numpy as np
+
+import rotate
+import BatchedPotential.batched_potential_energy as batched_potential_energy
+import DihedralPotential.dihedral_energy_profile as dihedral_energy_profile
+import IO.trajectory as trajectory
+
+# Systematic conformer search over the joint torsion grid of the rotatable
+# bonds. Every dihedral is centered on exactly one bond and a rigid rotation
+# around another bond leaves it unchanged, so the dihedral energy of a
+# conformer is the sum of one closed-form profile per bond (see
+# dihedral_energy_profile) plus a constant. The grid is explored depth-first
+# by branch and bound: the angles of each bond are tried from the lowest
+# energy up, and a branch is cut as soon as its energy plus the minima of the
+# bonds still to be set exceeds the n-th best conformer found so far, or the
+# lowest energy plus energy_window.
+
+class ConformerSearchResult:
+    def __init__(self):
+        self.bonds    = None  # (nbonds, 2) rotatable bonds b-c (0-based)
+        self.angles   = None  # (nconformers, nbonds) rotation of each bond (radians)
+        self.energies = None  # (nconformers,) dihedral energy, lowest first
+        self.coords   = None  # (nconformers, natoms, 3) coordinates
+        self.nodes    = 0     # number of grid nodes visited
+
+def get_rotatable_bonds(molecule):
+    # Unique central bonds of the dihedrals with parameters, except ring bonds
+    # and bonds with a terminal atom
+    top = batched_potential_energy.get_parameters(molecule)
+    graph = molecule.get_bond_graph()
+    degrees = graph.get_degrees()
+    rows = np.flatnonzero(np.diff(top.dihedral_ptr) > 0)
+    centers = np.unique(np.sort(top.dihedral_index[rows, 1:3], axis=1), axis=0)
+    bonds = [(b, c) for b, c in centers.tolist()
+             if degrees[b] > 1 and degrees[c] > 1 and not graph.is_ring_bond(b, c)]
+    return np.array(bonds, dtype=np.intp).reshape(-1, 2)
+
+def build_conformer(molecule, bonds, rlists, angles, coords=None):
+    # Coordinates after rotating each bond by its angle. The rotations are
+    # applied one after the other, each around the current position of its
+    # bond; the resulting dihedral angles do not depend on the order.
+    if coords is None:
+        coords = batched_potential_energy.get_coordinates(molecule)
+    coords = coords.copy()
+    for (b, c), rlist, angle in zip(bonds, rlists, angles):
+        origin = coords[b].copy()
+        axis = coords[c] - origin
+        axis /= np.sqrt(axis.dot(axis))
+        rotate.rotate_coordinates(coords, rlist, origin, rotate.rotation_matrix(axis, angle))
+    return coords
+
+def conformer_search(molecule, theta=math.pi/6, nconformers=10, energy_window=None,
+                     bonds=None, mol2_name=None, store=None):
+    # The conformers found can be written to mol2_name and/or to store (an
+    # IO.conformer_store.ConformerStore open for writing)
+    result = ConformerSearchResult()
+    if bonds is None:
+        bonds = get_rotatable_bonds(molecule)
+    bonds = np.asarray(bonds, dtype=np.intp).reshape(-1, 2)
+    grid = theta * np.arange(int(round(2 * math.pi / theta)))
+    rlists = [np.asarray(rotate.get_rotation_list(molecule, b+1, c+1)[1:], dtype=np.intp)
+              for b, c in bonds]
+    # one energy table per bond, with the constant part counted only once
+    tables = []
+    constant = None
+    for (b, c), rlist in zip(bonds, rlists):
+        terms = dihedral_energy_profile.get_torsion_terms(molecule, b, c, rlist)
+        tables.append(dihedral_energy_profile.torsion_profile(terms[:6] + (0.0,), grid))
+        if constant is None:
+            constant = terms[6]
+        else:
+            constant -= tables[-1][0]
+    if constant is None:
+        constant = batched_potential_energy.dihedral_potential(molecule)
+    # bonds with the largest spread first, so that bounds become tight early
+    order = sorted(range(len(bonds)), key=lambda k: tables[k].min() - tables[k].max())
+    tables = [tables[k] for k in order]
+    bonds, rlists = bonds[order], [rlists[k] for k in order]
+    minima = [table.min() for table in tables]
+    rest = np.concatenate((np.cumsum(minima[::-1])[::-1], [0.0]))  # rest[d]: bound of bonds d..
+    sorted_steps = [np.argsort(table, kind='stable') for table in tables]
+
+    best = []  # heap of (-energy, steps) of the nconformers lowest conformers
+    steps = [0] * len(bonds)
+
+    def cutoff():
+        limit = math.inf
+        if len(best) == nconformers:
+            limit = -best[0][0]
+        if energy_window is not None:
+            limit = min(limit, constant + rest[0] + energy_window)
+        return limit
+
+    def search(depth, energy):
+        result.nodes += 1
+        if depth == len(bonds):
+            if len(best) < nconformers:
+                heapq.heappush(best, (-energy, tuple(steps)))
+            else:
+                heapq.heappushpop(best, (-energy, tuple(steps)))
+            return
+        for k in sorted_steps[depth]:
+            value = energy + tables[depth][k]
+            if value + rest[depth + 1] > cutoff():
+                break  # the remaining angles of this bond are higher still
+            steps[depth] = k
+            search(depth + 1, value)
+
+    search(0, constant)
+    found = sorted((-e, s) for e, s in best)
+    result.bonds = bonds
+    result.energies = np.array([e for e, s in found])
+    result.angles = grid[np.array([s for e, s in found], dtype=np.intp).reshape(len(found), len(bonds))]
+    coords = batched_potential_energy.get_coordinates(molecule)
+    result.coords = np.array([build_conformer(molecule, bonds, rlists, angles, coords)
+                              for angles in result.angles]).reshape(len(found), molecule.num_atoms, 3)
+    if mol2_name is not None:
+        with trajectory.Mol2TrajectoryWriter(molecule, mol2_name, 'w+') as writer:
+            for frame in result.coords:
+                writer.write_frame(frame)
+    if store is not None:
+        store.write_frame(result.coords, result.energies)
+    return result
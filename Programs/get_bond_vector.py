@@ -1,4 +1,3 @@
 def get_bond_vector_v12(molecule, atom1, atom2):
-    return (molecule.x[atom2] - molecule.x[atom1],
-            molecule.y[atom2] - molecule.y[atom1],
-            molecule.z[atom2] - molecule.z[atom1])
\ No newline at end of file
+    v12 = molecule.coords[atom2] - molecule.coords[atom1]
+    return v12[0], v12[1], v12[2]
\ No newline at end of file
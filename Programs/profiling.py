@@ -0,0 +1,164 @@
+import contextlib
+import functools
+import importlib
+import json
+import sys
+import time
+
+# Opt-in call counters and timers for the energy, force, rotation and I/O
+# entry points. enable() replaces every function of ENTRY_POINTS (module
+# attributes and class methods) by a wrapper that counts its calls and adds up
+# its wall time; disable() puts the original functions back. Callers look the
+# functions up through their modules, so they go through the wrappers while
+# profiling is on, and nothing is added to the calls while it is off.
+# The time of a function includes the functions it calls (recursive calls are
+# timed once, at the outermost call).
+
+VERSION = 1
+
+# (module, attribute) of the instrumented functions; attribute may be
+# 'Class.method'
+ENTRY_POINTS = (
+    ('BatchedPotential.batched_potential_energy', 'bond_potential'),
+    ('BatchedPotential.batched_potential_energy', 'angle_potential'),
+    ('BatchedPotential.batched_potential_energy', 'dihedral_potential'),
+    ('BatchedPotential.batched_potential_energy', 'bond_parameters'),
+    ('BatchedPotential.batched_potential_energy', 'angle_parameters'),
+    ('BatchedPotential.batched_potential_energy', 'dihedral_parameters'),
+    ('BatchedPotential.batched_potential_energy', 'get_dihedral_subset'),
+    ('BatchedForce.batched_force', 'energy_and_forces'),
+    ('BondForce.bond_force', 'bond_force'),
+    ('AngleForce.angle_force', 'angle_force'),
+    ('DihedralForce.dihedral_force', 'dihedral_force'),
+    ('DihedralPotential.incremental_dihedral_potential', 'DihedralEnergyCache.update'),
+    ('DihedralPotential.dihedral_energy_profile', 'get_torsion_terms'),
+    ('DihedralPotential.dihedral_energy_profile', 'dihedral_energy_profile'),
+    ('NonbondedPotential.nonbonded_potential_energy', 'nonbonded_energy_forces'),
+    ('NonbondedPotential.neighbor_list', 'NeighborList.build'),
+    ('rotate', 'rotate'),
+    ('rotate', 'rotate_atoms'),
+    ('rotate', 'get_rotation_list'),
+    ('heuristic_conformation', 'heuristic_conformation'),
+    ('heuristic_conformation', 'heuristic_rotate'),
+    ('conformer_search', 'conformer_search'),
+    ('Minimization.minimize', 'minimize'),
+    ('Classes.Molecule', 'Molecule.assign_parameters'),
+    ('Classes.Molecule', 'Molecule.read_mol2'),
+    ('Classes.Molecule', 'Molecule.read_psf'),
+    ('Classes.Molecule', 'Molecule.read_pdb'),
+    ('Classes.Molecule', 'Molecule.read_frcmod'),
+    ('Classes.Molecule', 'Molecule.write_mol2'),
+    ('Classes.Molecule', 'Molecule.write_psf'),
+    ('Classes.Molecule', 'Molecule.write_pdb'),
+    ('Classes.Molecule', 'Molecule.save_snapshot'),
+    ('Classes.Molecule', 'Molecule.load_snapshot'),
+    ('IO.trajectory', 'Mol2TrajectoryWriter.write_frame'),
+    ('IO.trajectory', 'NpyArrayWriter.write_frame'),
+)
+
+_stats     = {} # name -> [calls, seconds]
+_active    = {} # name -> depth of the calls in progress
+_installed = {} # (owner, attribute) -> original function
+_enabled   = 0  # nesting level of enable()
+
+def _name(module, attribute):
+    if '.' in attribute:
+        return attribute
+    return '{}.{}'.format(module.split('.')[-1], attribute)
+
+def profiled(function, name=None):
+    # Wrapper of function that records its calls under name while profiling
+    # is enabled; it can also be used as a decorator
+    if name is None:
+        name = _name(function.__module__, function.__qualname__)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+        depth = _active.get(name, 0)
+        _active[name] = depth + 1
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stats = _stats.setdefault(name, [0, 0.0])
+            stats[0] += 1
+            if depth == 0:
+                stats[1] += time.perf_counter() - start
+            _active[name] = depth
+    wrapper.__wrapped__ = function
+    return wrapper
+
+def _owner(module, attribute):
+    owner = importlib.import_module(module)
+    path = attribute.split('.')
+    for part in path[:-1]:
+        owner = getattr(owner, part)
+    return owner, path[-1]
+
+def enable(entry_points=ENTRY_POINTS):
+    # Instruments the entry points (once; calls may be nested)
+    global _enabled
+    if _enabled == 0:
+        for module, attribute in entry_points:
+            owner, name = _owner(module, attribute)
+            original = owner.__dict__[name]
+            _installed[(owner, name)] = original
+            setattr(owner, name, profiled(original, _name(module, attribute)))
+    _enabled += 1
+
+def disable():
+    global _enabled
+    if _enabled == 0:
+        return
+    _enabled -= 1
+    if _enabled == 0:
+        for (owner, name), original in _installed.items():
+            setattr(owner, name, original)
+        _installed.clear()
+        _active.clear()
+
+def is_enabled():
+    return _enabled > 0
+
+def count(name, n=1):
+    # Adds n to a counter (no time) while profiling is enabled
+    if _enabled:
+        stats = _stats.setdefault(name, [0, 0.0])
+        stats[0] += n
+
+def reset():
+    _stats.clear()
+
+def get_stats():
+    # {name: {'calls': ..., 'seconds': ...}} of what was recorded so far
+    return {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in _stats.items()}
+
+def dump(filename, **extra):
+    # Writes the statistics (and any extra fields) as JSON
+    report = dict(extra, version=VERSION, time=time.strftime('%Y-%m-%dT%H:%M:%S'), stats=get_stats())
+    with open(filename, 'w') as outf:
+        json.dump(report, outf, indent=1, sort_keys=True)
+
+def report(out=sys.stdout):
+    # Table of the statistics, from the largest time down
+    out.write('{:45s} {:>10s} {:>12s}\n'.format('function', 'calls', 'seconds'))
+    for name, (calls, seconds) in sorted(_stats.items(), key=lambda item: -item[1][1]):
+        out.write('{:45s} {:10d} {:12.6f}\n'.format(name, calls, seconds))
+
+@contextlib.contextmanager
+def profile(filename=None, entry_points=ENTRY_POINTS, **extra):
+    # Profiles the body of a with statement, from zero unless profiling was
+    # already on, and writes the statistics to filename (if given) at its end
+    #   with profiling.profile('stats.json'):
+    #       heuristic_conformation.heuristic_conformation(molecule, theta)
+    if not _enabled:
+        reset()
+    enable(entry_points)
+    try:
+        yield _stats
+    finally:
+        disable()
+        if filename is not None:
+            dump(filename, **extra)
@@ -1,7 +1,10 @@
 import math
+import numpy as np
 import argparse
 import os
 from Classes.Molecule import Molecule
+import BatchedPotential.batched_potential_energy as batched_potential_energy
+import IO.trajectory as trajectory
     
 def get_cmd_line():
     parser = argparse.ArgumentParser(description='MOL2 reader, chain rotator.')
@@ -11,75 +14,67 @@ def get_cmd_line():
     # Assign from cmd line.
     return arguments.mol2, arguments.new_mol2
 
-def set_rotation_angle(theta):
-    global cos0, sin0, t
+def get_rotation_axis(molecule, a, b):
+    # For the construction of the rotation matrix around the axis defined by 
+    # the bond that connects atoms a and b (vector ab, a to b), ab unit vector 
+    # has to be determined. Returns the position of a (a point of the axis) 
+    # and the unit vector, or a zero vector if both atoms coincide.
+    coords = batched_potential_energy.get_coordinates(molecule)
+    origin = coords[a]
+    AB = coords[b] - origin
+    M = np.sqrt(AB.dot(AB))  # M is the magnitude of vector ab
+    if M != 0:
+        return origin, AB / M
+    return origin, np.zeros(3)
+
+def rotation_matrix(axis, theta):
+    # Rodrigues' rotation matrix for an angle theta around the unit vector axis
+    ux, uy, uz = axis
     cos0 = math.cos(theta)  # cosine of the angle of rotation
     sin0 = math.sin(theta)  # sine of the angle of rotation
     t = 1 - cos0
+    return np.array([
+        [cos0 + t*ux*ux, t*ux*uy - sin0*uz, t*ux*uz + sin0*uy],
+        [t*ux*uy + sin0*uz, cos0 + t*uy*uy, t*uy*uz - sin0*ux],
+        [t*ux*uz - sin0*uy, t*uy*uz + sin0*ux, cos0 + t*uz*uz]])
 
-def init_rotation_axis(molecule, a, b, theta):
-    # For the construction of the rotation matrix around the axis defined by 
-    # the bond that connects atoms a and b (vector ab, a to b), ab unit vector 
-    # has to be determined. A unit vector is mathematicaly defined as its 
-    # original components divided by the square root of its magnitude.
-    global Ax, Ay, Az, ux, uy, uz
-    Ax = molecule.x[a]
-    Ay = molecule.y[a]
-    Az = molecule.z[a]
-    Bx = molecule.x[b]
-    By = molecule.y[b]
-    Bz = molecule.z[b]
-    ABx = Bx - Ax
-    ABy = By - Ay
-    ABz = Bz - Az
-    M = (ABx*ABx + ABy*ABy + ABz*ABz)**0.5
-    # M is the magnitude of the unit vector u
-    if M != 0:
-        ux = ABx/M # x component of u
-        uy = ABy/M # y component of u
-        uz = ABz/M # z component of u
-    else:
-        ux = 0
-        uy = 0
-        uz = 0
-    set_rotation_angle(theta)
+def rotate_coordinates(coords, atoms, origin, matrix):
+    # Rotates coords[..., atoms, :] in place, as one matrix product over the 
+    # (M, 3) block of the atoms (or a (K, M, 3) stack of conformers)
+    coords[..., atoms, :] = (coords[..., atoms, :] - origin) @ matrix.T + origin
 
-def rotate_atom(molecule, i):
-    x1 = molecule.x[i] - Ax
-    y1 = molecule.y[i] - Ay
-    z1 = molecule.z[i] - Az
-    molecule.x[i] = Ax + (cos0 + t*ux*ux)*x1 + (t*ux*uy - sin0*uz)*y1 + (t*ux*uz + sin0*uy)*z1
-    molecule.y[i] = Ay + (t*ux*uy + sin0*uz)*x1 + (cos0 + t*uy*uy)*y1 + (t*uy*uz - sin0*ux)*z1
-    molecule.z[i] = Az + (t*ux*uz - sin0*uy)*x1 + (t*uy*uz + sin0*ux)*y1 + (cos0 + t*uz*uz)*z1
-    
-def recursive_rotation_list(molecule, atom, previous, rlist):
-    k = int(atom*(atom-1)/2)
-    for i in range(atom-1, -1, -1):
-        if molecule.topology.bond_matrix[k + i] and i != previous and i not in rlist:
-            rlist.append(i)
-            recursive_rotation_list(molecule, i, atom, rlist)
-    for i in range(atom+1, molecule.num_atoms):
-        if molecule.topology.bond_matrix[int(i * (i - 1) / 2 + atom)] and i != previous and i not in rlist:
-            rlist.append(i)
-            recursive_rotation_list(molecule, i, atom, rlist)
+def rotate_atoms(molecule, atoms, origin, matrix):
+    # Rotates the given atoms of the molecule around the axis through origin
+    rotate_coordinates(molecule.coords, np.asarray(atoms, dtype=np.intp), origin, matrix)
 
-def rotate(molecule, rotation_list, a, b, theta, ntimes, write_mol2=False, mol2_name=None):
-    init_rotation_axis(molecule, a-1, b-1, theta)
-    if not write_mol2:
-        for i in range(ntimes):
-            for atom in rotation_list[1:]:
-                rotate_atom(molecule, atom)
-    else:
-        molecule.write_mol2(mol2_name, 'w+')
-        for i in range(ntimes):
-            for atom in rotation_list[1:]:
-                rotate_atom(molecule, atom)
-            molecule.write_mol2(mol2_name, 'a')
+def rotate(molecule, rotation_list, a, b, theta, ntimes, write_mol2=False, mol2_name=None,
+           npy_name=None):
+    # Every step can be written to mol2_name (text) and/or to npy_name, a
+    # binary (ntimes + 1, natoms, 3) stack of frames
+    origin, axis = get_rotation_axis(molecule, a-1, b-1)
+    matrix = rotation_matrix(axis, theta)
+    atoms = np.asarray(rotation_list[1:], dtype=np.intp)
+    writers = []
+    if write_mol2:
+        writers.append(trajectory.Mol2TrajectoryWriter(molecule, mol2_name, 'w+'))
+    if npy_name is not None:
+        writers.append(trajectory.NpyTrajectoryWriter(npy_name, molecule.num_atoms))
+    for writer in writers:
+        writer.write_frame(batched_potential_energy.get_coordinates(molecule))
+    for i in range(ntimes):
+        rotate_atoms(molecule, atoms, origin, matrix)
+        if writers:
+            coords = batched_potential_energy.get_coordinates(molecule)
+            for writer in writers:
+                writer.write_frame(coords)
+    for writer in writers:
+        writer.close()
                       
 def get_rotation_list(molecule, a, b):
-    rotation_list = [b-1]
-    recursive_rotation_list(molecule, b-1, a-1, rotation_list)
-    return rotation_list
+    # Atoms (0-based) that move in a rotation around the bond a-b (1-based 
+    # numbers), b-1 first: the side of b, found by a breadth-first search over 
+    # the bond graph
+    return molecule.get_bond_graph().get_moving_side(a-1, b-1).tolist()
 
 def main():
 
@@ -0,0 +1,365 @@
+import argparse
+import math
+
+import numpy as np
+
+from Classes.Molecule import Molecule
+import Classes.ForceField as ForceField
+import BatchedPotential.batched_potential_energy as batched_potential_energy
+
+# Synthetic molecules of any size with GAFF types and parameters, for scaling
+# tests: n-alkanes CnH2n+2, branched alkanes (a methyl group on every
+# branch_every-th carbon of the chain) and polyols HOCH2(CHOH)n-2CH2OH. The
+# carbon chain is a zig-zag whose backbone dihedrals alternate a little
+# around trans (see BEND and TWIST), so that long chains coil into a wide
+# solenoid instead of a straight rod that would leave the coordinate range of
+# the pdb format. Every carbon has its two free tetrahedral positions on
+# both sides of the plane of its bonds (three at the ends), which hold the
+# hydrogens, methyl groups or hydroxyls. Coordinates and topology are built
+# with array math, so 100,000 atoms take less than a second. The parameters are those of the bundled butane and
+# Etileno_glicol frcmod files; get_frcmod_text writes the ones a molecule
+# uses, so that it can be saved with write_files and read back.
+
+KINDS = ('alkane', 'branched', 'polyol')
+
+MASSES = {'c3': 12.010, 'hc': 1.008, 'h1': 1.008, 'oh': 16.000, 'ho': 1.008}
+ELEMENTS = {'c3': 'C', 'hc': 'H', 'h1': 'H', 'oh': 'O', 'ho': 'H'}
+CHARGES = {'hc': 0.06, 'h1': 0.06, 'oh': -0.65, 'ho': 0.41} # carbons balance their groups
+BONDS = {'c3-c3': (300.90, 1.538), 'c3-hc': (330.60, 1.097), 'c3-h1': (330.60, 1.097),
+         'c3-oh': (316.70, 1.423), 'ho-oh': (371.40, 0.973)}
+ANGLES = {'c3-c3-c3': (62.860, 111.510), 'c3-c3-hc': (46.340, 109.800),
+          'hc-c3-hc': (39.400, 107.580), 'c3-c3-h1': (46.400, 109.560),
+          'h1-c3-h1': (39.200, 108.460), 'c3-c3-oh': (67.500, 110.190),
+          'h1-c3-oh': (50.900, 110.260), 'c3-oh-ho': (47.400, 107.260)}
+# [Vn, phase (degrees), n] terms; a negative n means that more terms follow
+DIHEDRALS = {'c3-c3-c3-c3': [(0.180, 0.0, -3.0), (0.250, 180.0, -2.0), (0.200, 180.0, 1.0)],
+             'c3-c3-c3-hc': [(0.160, 0.0, 3.0)],
+             'hc-c3-c3-hc': [(0.150, 0.0, 3.0)],
+             'c3-c3-oh-ho': [(0.160, 0.0, -3.0), (0.250, 0.0, 1.0)],
+             'oh-c3-c3-oh': [(0.144, 0.0, -3.0), (1.175, 0.0, 2.0)],
+             'h1-c3-c3-oh': [(0.000, 0.0, -3.0), (0.250, 0.0, 1.0)]}
+# general X-b-c-X terms of the dihedrals without specific parameters
+GENERAL_DIHEDRALS = {'c3-c3': [(1.400 / 9, 0.0, 3.0)], 'c3-oh': [(0.500 / 3, 0.0, 3.0)]}
+NONBONDED = {'c3': (1.9080, 0.1094), 'hc': (1.4870, 0.0157), 'h1': (1.3870, 0.0157),
+             'oh': (1.7210, 0.2104), 'ho': (0.0000, 0.0000)}
+# tetrahedral angle between each free position and the bisector of the other two bonds
+HALF_TETRAHEDRAL = math.acos(1 / math.sqrt(3))
+# backbone dihedrals are 180 - BEND + TWIST and 180 + BEND + TWIST degrees in
+# turn: BEND curves the chain into turns of about 120 carbons and 50 A, and
+# TWIST sets consecutive turns 22 A apart, i.e. about 0.17 A of length per carbon
+BEND = 5.0
+TWIST = 0.5
+
+def get_cmd_line():
+    parser = argparse.ArgumentParser(description='Synthetic alkanes and polyols with GAFF parameters.')
+    parser.add_argument('--kind',    action='store', dest='kind',    default='alkane', choices=KINDS)
+    parser.add_argument('--carbons', action='store', dest='carbons', type=int, help='Carbons of the chain.')
+    parser.add_argument('--atoms',   action='store', dest='atoms',   type=int, help='Approximate number of atoms (instead of --carbons).')
+    parser.add_argument('--branch_every', action='store', dest='branch_every', type=int, default=3)
+    parser.add_argument('--out',     action='store', dest='out',     required=True, help='Base name of the .mol2, .psf, .pdb and .frcmod files.')
+    parser.add_argument('--check',   action='store_true', dest='check', help='Read the files back and compare them with the molecule.')
+    arguments = parser.parse_args()
+    if (arguments.carbons is None) == (arguments.atoms is None):
+        parser.error('give exactly one of --carbons and --atoms')
+    return arguments
+
+def _unit(v):
+    return v / np.sqrt(np.einsum('...i,...i->...', v, v))[..., None]
+
+def _key(types):
+    # canonical (lowest of both directions) key of a type combination
+    return min('-'.join(types), '-'.join(types[::-1]))
+
+def _backbone(npoints):
+    # (npoints, 3) positions of a chain with the c3-c3 bond length and
+    # c3-c3-c3 angle and the BEND/TWIST dihedrals. Every atom after the
+    # third is placed from the frame (bond, in-plane normal, plane normal,
+    # position) of the atom before it, by a rigid transform that only
+    # depends on the dihedral; the frames are the prefix products of these
+    # transforms, computed in log2(npoints) batched steps.
+    cc = BONDS['c3-c3'][1]
+    angle = math.radians(ANGLES['c3-c3-c3'][1])
+    points = np.zeros((max(npoints, 3), 3))
+    points[1, 0] = cc
+    points[2] = (cc - cc * math.cos(angle), cc * math.sin(angle), 0.0)
+    phi = np.radians(180.0 + TWIST + BEND * (-1.0) ** np.arange(max(npoints - 3, 0)))
+    step = np.zeros((len(phi), 4, 4))
+    bond = np.stack((-np.full(len(phi), math.cos(angle)), math.sin(angle) * np.cos(phi),
+                     math.sin(angle) * np.sin(phi)), axis=1)
+    normal = np.stack((np.zeros(len(phi)), -np.sin(phi), np.cos(phi)), axis=1)
+    step[:, :3, 0] = bond
+    step[:, :3, 1] = np.cross(normal, bond)
+    step[:, :3, 2] = normal
+    step[:, :3, 3] = cc * bond
+    step[:, 3, 3] = 1.0
+    shift = 1
+    while shift < len(step):
+        step[shift:] = step[:-shift] @ step[shift:]
+        shift *= 2
+    frame = np.eye(4)
+    frame[:3, 0] = _unit(points[2] - points[1])
+    frame[:3, 2] = _unit(np.cross(points[1] - points[0], frame[:3, 0]))
+    frame[:3, 1] = np.cross(frame[:3, 2], frame[:3, 0])
+    frame[:3, 3] = points[2]
+    points[3:] = (frame @ step)[:, :3, 3]
+    return points[:npoints]
+
+def _chain(ncarbons):
+    # Positions of the carbons and the free positions of every carbon:
+    # (ncarbons, 3) positions, (ncarbons, 2, 3) directions on both sides of
+    # the plane of its bonds, the directions of the first and last carbon
+    # along the chain and (ncarbons, 3) directions of the chain at every carbon.
+    # The backbone has the carbons -1..ncarbons; the first and last are where
+    # the chain would continue.
+    points = _backbone(ncarbons + 2)
+    carbons = points[1:-1]
+    before, after = points[:-2] - carbons, points[2:] - carbons
+    bisector = _unit(-(before + after))
+    # the normals of consecutive carbons point to opposite sides of the zig-zag
+    normal = _unit(np.cross(before, after)) * -(-1.0) ** np.arange(ncarbons)[:, None]
+    sides = np.stack((bisector * math.cos(HALF_TETRAHEDRAL) + normal * math.sin(HALF_TETRAHEDRAL),
+                      bisector * math.cos(HALF_TETRAHEDRAL) - normal * math.sin(HALF_TETRAHEDRAL)), axis=1)
+    ends = _unit(np.stack((points[0] - points[1], points[-1] - points[-2])))
+    return carbons, sides, ends, _unit(after - before)
+
+def _terminal(directions, axis):
+    # (M, 3, 3) tetrahedral positions around atoms bonded along directions
+    # (M, 3) (pointing away from the bonded atom), staggered about the
+    # (M, 3) axis directions
+    v = -directions
+    e1 = _unit(np.cross(v, axis))
+    e2 = np.cross(v, e1)
+    phi = np.array([0, 2 * math.pi / 3, 4 * math.pi / 3])
+    return (-v[:, None, :] / 3 + math.sqrt(8) / 3 *
+            (np.cos(phi)[None, :, None] * e1[:, None, :] + np.sin(phi)[None, :, None] * e2[:, None, :]))
+
+def build_molecule(kind, ncarbons, branch_every=3, precision='mixed'):
+    # Molecule with coordinates, topology (bonds, angles, dihedrals) and
+    # parameters assigned
+    if kind not in KINDS:
+        raise ValueError('Unknown kind: {}'.format(kind))
+    if ncarbons < 2:
+        raise ValueError('At least 2 carbons are needed')
+    if branch_every < 1:
+        raise ValueError('branch_every must be at least 1')
+    carbons, sides, ends, tangents = _chain(ncarbons)
+    index = np.arange(ncarbons)
+    # free positions: (owner carbon, direction); on both sides of the plane for
+    # every carbon, and in plane for the two ends
+    owner = np.concatenate((np.repeat(index, 2), [0, ncarbons - 1]))
+    direction = np.concatenate((sides.reshape(-1, 3), ends))
+    hydrogen = 'h1' if kind == 'polyol' else 'hc'
+    # the position of each carbon taken by a group: methyls alternate sides,
+    # hydroxyls are all on the same side (gauche O-C-C-O)
+    if kind == 'branched':
+        groups = index[(index % branch_every == branch_every // 2) & (index > 0) & (index < ncarbons - 1)]
+        group_slots = 2 * groups + (groups // branch_every) % 2
+    elif kind == 'polyol':
+        groups = index
+        group_slots = 2 * groups
+    else:
+        groups = index[:0]
+        group_slots = groups
+    is_group = np.zeros(len(owner), dtype=bool)
+    is_group[group_slots] = True
+
+    types, positions, bonds = [np.full(ncarbons, 'c3')], [carbons], []
+    natoms = ncarbons
+    bonds.append(np.stack((index[:-1], index[1:]), axis=1))
+    group_types = {'branched': ('c3', 'hc', BONDS['c3-c3'][1], BONDS['c3-hc'][1]),
+                   'polyol': ('oh', 'ho', BONDS['c3-oh'][1], BONDS['ho-oh'][1])}
+    if len(groups):
+        heavy, light, heavy_length, light_length = group_types[kind]
+        heavy_positions = carbons[groups] + heavy_length * direction[group_slots]
+        heavy_index = natoms + np.arange(len(groups))
+        types.append(np.full(len(groups), heavy))
+        positions.append(heavy_positions)
+        bonds.append(np.stack((groups, heavy_index), axis=1))
+        natoms += len(groups)
+        around = _terminal(direction[group_slots], tangents[groups])
+        if kind == 'branched':
+            # methyl hydrogens
+            light_positions = heavy_positions[:, None, :] + light_length * around
+            light_owner = np.repeat(heavy_index, 3)
+        else:
+            # one hydroxyl hydrogen, on the staggered position of lowest energy
+            light_positions = heavy_positions + light_length * around[:, 2]
+            light_owner = heavy_index
+        light_positions = light_positions.reshape(-1, 3)
+        types.append(np.full(len(light_positions), light))
+        positions.append(light_positions)
+        bonds.append(np.stack((light_owner, natoms + np.arange(len(light_positions))), axis=1))
+        natoms += len(light_positions)
+    # hydrogens on the remaining positions of the chain
+    free = ~is_group
+    hydrogen_length = BONDS['c3-{}'.format(hydrogen)][1]
+    types.append(np.full(free.sum(), hydrogen))
+    positions.append(carbons[owner[free]] + hydrogen_length * direction[free])
+    bonds.append(np.stack((owner[free], natoms + np.arange(free.sum())), axis=1))
+    natoms += free.sum()
+
+    molecule = Molecule(precision)
+    molecule.num_atoms = natoms = int(natoms)
+    atom_type = np.concatenate(types)
+    bonds = np.concatenate(bonds)
+    molecule.atom_type = atom_type
+    # shifted to start at the origin, as the pdb format has no room for
+    # large negative coordinates
+    coords = np.concatenate(positions)
+    molecule.coords = (coords - coords.min(axis=0)).astype(molecule.float_dtype)
+    _set_fields(molecule, atom_type, bonds)
+    molecule.set_bonds(bonds + 1)
+    molecule.gen_angle_list_from_bond_list()
+    molecule.gen_dihed_list_from_angle_list()
+    forcefield = ForceField.ForceField()
+    forcefield.parse_frcmod(get_frcmod_text(molecule))
+    molecule.set_forcefield(forcefield)
+    return molecule
+
+def _set_fields(molecule, atom_type, bonds):
+    # Names, charges, masses and the mol2/psf/pdb fields of every atom
+    natoms = molecule.num_atoms
+    element = np.array([ELEMENTS[t] for t in atom_type.tolist()])
+    # atom names fit the 4 columns of the PDB format
+    serial = np.zeros(natoms, dtype=np.intp)
+    for e in np.unique(element):
+        mask = element == e
+        serial[mask] = np.arange(mask.sum()) % 999 + 1
+    molecule.atom = np.char.add(element, serial.astype('U3'))
+    # neutral groups: every carbon balances the charges of the atoms bonded
+    # to it that are not carbons, and every oxygen includes its hydrogen
+    charge = np.array([CHARGES.get(t, 0.0) for t in atom_type.tolist()])
+    group = charge.copy()
+    i, j = bonds[:, 0], bonds[:, 1]
+    oxygen_hydrogen = atom_type[j] == 'ho'
+    group[i[oxygen_hydrogen]] += charge[j[oxygen_hydrogen]]
+    substituent = atom_type[j] != 'c3'
+    substituent &= atom_type[i] == 'c3'
+    carbon = np.zeros(natoms)
+    np.add.at(carbon, i[substituent], -group[j[substituent]])
+    charge = np.where(atom_type == 'c3', carbon, charge)
+    molecule.molecule_type, molecule.charge_type = 'SMALL', 'USER_CHARGES'
+    top = molecule.topology
+    top.charge = charge.astype(molecule.float_dtype)
+    top.mass = np.array([MASSES[t] for t in atom_type.tolist()]).astype(molecule.float_dtype)
+    top.subst_id = np.ones(natoms, dtype=np.uint8)
+    top.subst_name = np.full(natoms, 'MOL')
+    top.num_subst = 1
+    top.substructures = ['     1 MOL         1 TEMP              0 ****  ****    0 ROOT']
+    top.segid, top.resname, top.name = np.full(natoms, 'MOL'), np.full(natoms, 'MOL'), molecule.atom.copy()
+    top.resid = np.ones(natoms, dtype=np.int32)
+    molecule.id, molecule.residue, molecule.chain = np.full(natoms, 'ATOM'), np.full(natoms, 'MOL'), np.full(natoms, 'A')
+    molecule.alt_loc, molecule.ins_code, molecule.charge = np.full(natoms, ''), np.full(natoms, ''), np.full(natoms, '')
+    molecule.res_num = np.ones(natoms, dtype=np.int32)
+    molecule.occup = np.ones(natoms, dtype=molecule.float_dtype)
+    molecule.temp = np.zeros(natoms, dtype=molecule.float_dtype)
+    molecule.element = element
+
+def _combinations(molecule, flat_list, width):
+    # unique canonical type keys of the terms of a topology list
+    index = batched_potential_energy.get_index_array(flat_list, width)
+    if len(index) == 0:
+        return []
+    combos = batched_potential_energy.type_keys(molecule, index)[0]
+    return sorted(set(_key(c) for c in combos.tolist()))
+
+def get_frcmod_text(molecule):
+    # frcmod file with the parameters of every bond, angle and dihedral type
+    # combination of the molecule. Dihedral barriers are already divided (the
+    # divider column is 1).
+    top = molecule.topology
+    lines = ['Synthetic molecule, GAFF parameters', 'MASS']
+    used = sorted(set(np.asarray(molecule.atom_type).tolist()))
+    for t in used:
+        lines.append('{:2s} {:<8.3f}'.format(t, MASSES[t]))
+    lines += ['', 'BOND']
+    for key in _combinations(molecule, top.bond_list, 2):
+        lines.append('{:<5s}{:>8.2f}{:>8.3f}'.format(key, *BONDS[key]))
+    lines += ['', 'ANGLE']
+    for key in _combinations(molecule, top.angle_list, 3):
+        lines.append('{:<8s}{:>9.3f}{:>12.3f}'.format(key, *ANGLES[key]))
+    lines += ['', 'DIHE']
+    for key in _combinations(molecule, top.dihedral_list, 4):
+        terms = DIHEDRALS.get(key)
+        if terms is None:
+            terms = GENERAL_DIHEDRALS[_key(key.split('-')[1:3])]
+        for Vn, phase, n in terms:
+            lines.append('{:<11s}{:>4d}{:>9.3f}{:>14.3f}{:>16.3f}'.format(key, 1, Vn, phase, n))
+    lines += ['', 'IMPROPER', '', 'NONBON']
+    for t in used:
+        lines.append('  {:<10s}{:>8.4f}{:>8.4f}'.format(t, *NONBONDED[t]))
+    return '\n'.join(lines) + '\n\n\n'
+
+def write_frcmod(molecule, filename):
+    with open(filename, 'w') as outf:
+        outf.write(get_frcmod_text(molecule))
+
+def write_files(molecule, base):
+    # base.mol2, base.psf, base.pdb and base.frcmod; returns their names
+    files = {'mol2': base + '.mol2', 'psf': base + '.psf', 'pdb': base + '.pdb',
+             'frcmod': base + '.frcmod'}
+    molecule.write_mol2(files['mol2'], 'w')
+    molecule.write_psf(files['psf'])
+    molecule.write_pdb(files['pdb'], 'w', 1)
+    write_frcmod(molecule, files['frcmod'])
+    return files
+
+def read_files(files, precision='mixed'):
+    # The molecules read back from write_files: one from the mol2 file and
+    # one from the psf and pdb files, both with the frcmod parameters
+    from_mol2 = Molecule(precision)
+    from_mol2.read_mol2(files['mol2'])
+    from_mol2.gen_dihed_list_from_angle_list()
+    from_mol2.read_frcmod(files['frcmod'])
+    from_psf = Molecule(precision)
+    from_psf.read_psf(files['psf'])
+    from_psf.read_pdb(files['pdb'])
+    from_psf.read_frcmod(files['frcmod'])
+    return from_mol2, from_psf
+
+def check_files(molecule, files):
+    # Raises ValueError if a molecule read back from the files of write_files
+    # differs from molecule in its atoms, types, bonds, coordinates (within
+    # the 3 decimals of the pdb format) or energies
+    energies = [batched_potential_energy.bond_potential, batched_potential_energy.angle_potential,
+                batched_potential_energy.dihedral_potential]
+    expected = [energy(molecule) for energy in energies]
+    for name, other in zip(('mol2', 'psf/pdb'), read_files(files, molecule.precision)):
+        if other.num_atoms != molecule.num_atoms:
+            raise ValueError('{}: {} atoms, expected {}'.format(name, other.num_atoms, molecule.num_atoms))
+        if not np.array_equal(np.asarray(other.atom_type), np.asarray(molecule.atom_type)):
+            raise ValueError('{}: atom types differ'.format(name))
+        if not np.array_equal(np.asarray(other.topology.bond_list, dtype=np.int64),
+                              np.asarray(molecule.topology.bond_list, dtype=np.int64)):
+            raise ValueError('{}: bonds differ'.format(name))
+        if not np.allclose(other.coords, molecule.coords, atol=1e-3):
+            raise ValueError('{}: coordinates differ'.format(name))
+        found = [energy(other) for energy in energies]
+        if not np.allclose(found, expected, rtol=1e-3, atol=1e-3 * molecule.num_atoms):
+            raise ValueError('{}: energies {} differ from {}'.format(name, found, expected))
+
+def carbons_for_atoms(kind, natoms, branch_every=3):
+    # Chain length that gives about natoms atoms
+    if branch_every < 1:
+        raise ValueError('branch_every must be at least 1')
+    if kind == 'polyol':
+        per_carbon = 4                      # C, O and 2 H
+    elif kind == 'branched':
+        per_carbon = 3 + 3 / branch_every   # CH2 plus a share of the CH3 groups
+    else:
+        per_carbon = 3
+    return max(2, int(round((natoms - 2) / per_carbon)))
+
+def main():
+    arguments = get_cmd_line()
+    ncarbons = arguments.carbons
+    if ncarbons is None:
+        ncarbons = carbons_for_atoms(arguments.kind, arguments.atoms, arguments.branch_every)
+    molecule = build_molecule(arguments.kind, ncarbons, arguments.branch_every)
+    files = write_files(molecule, arguments.out)
+    print('{} atoms written to {}.*'.format(molecule.num_atoms, arguments.out))
+    if arguments.check:
+        check_files(molecule, files)
+        print('files read back: same atoms, bonds, coordinates and energies')
+
+if __name__ == '__main__': main()